@@ -0,0 +1,86 @@
+"""
+Benchmark of the cold-start latency of myfiles.
+
+Each command is run in a fresh interpreter, several times,
+and the minimum and median wall-clock times are reported,
+along with the time of an empty interpreter for reference.
+
+Usage:
+    python benchmarks/startup.py [-n REPEAT] [--importtime]
+"""
+import os
+import sys
+import time
+import statistics
+import subprocess
+from argparse import ArgumentParser
+from pathlib import Path
+
+topdir = Path(__file__).absolute().parent.parent
+
+commands = {
+    'python': ['-c', 'pass'],
+    'import myfiles': ['-c', 'import myfiles'],
+    'import myfiles.Project': ['-c', 'import myfiles; myfiles.Project'],
+    'myfiles -h': ['-m', 'myfiles', '-h'],
+    'myfiles check_remote': ['-m', 'myfiles', 'check_remote'],
+    }
+
+
+def get_env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [str(topdir)] + env.get('PYTHONPATH', '').split(os.pathsep))
+    env['PYTHONDONTWRITEBYTECODE'] = ''
+    return env
+
+
+def time_command(arguments, repeat, env):
+    """Return the wall-clock times of a command, in milliseconds."""
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + arguments, env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(1e3 * (time.perf_counter() - start))
+    return times
+
+
+def get_slowest_imports(arguments, env, n=15):
+    """Return the n imports with the largest cumulative time."""
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + arguments,
+                            env=env, capture_output=True, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        imports.append((int(cumulative), name.rstrip()))
+    imports.sort(reverse=True)
+    return imports[:n]
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('-n', '--repeat', type=int, default=20,
+                        help='Number of runs of each command.')
+    parser.add_argument('--importtime', action='store_true',
+                        help='Also show the slowest imports of the CLI.')
+    args = parser.parse_args()
+
+    env = get_env()
+    print(f'{"command":<26} {"min (ms)":>10} {"median (ms)":>12}')
+    for name, arguments in commands.items():
+        times = time_command(arguments, args.repeat, env)
+        print(f'{name:<26} {min(times):>10.1f} '
+              f'{statistics.median(times):>12.1f}')
+
+    if args.importtime:
+        print('\nSlowest imports of myfiles check_remote (cumulative us):')
+        arguments = commands['myfiles check_remote']
+        for cumulative, name in get_slowest_imports(arguments, env):
+            print(f'{cumulative:>10} {name}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,60 @@
-from . import util
-from . import cli_functions
-from .config import *
-from .project import *
-from .node import *
-from .data import *
-from .helper_functions import *
+"""
+Submodules are imported when one of their names is first used,
+so that the command line interface starts quickly.
+"""
+import importlib
+
+_submodules = ('util', 'cli_functions', 'config', 'project', 'node', 'data',
+               'helper_functions', 'nodeid', 'nodedir', 'index', 'database',
+               'transfer', 'pseudos', 'manifest', 'sshconfig')
+
+# Public names, by submodule.
+_exports = {
+    'config': ['Config', 'UserConfig', 'ProjectConfig', 'NodeConfig',
+               'RemoteHosts'],
+    'project': ['Project'],
+    'node': ['Node'],
+    'data': ['DataDir', 'DataDirs'],
+    # All the names of helper_functions.__all__, see _check_exports.
+    'helper_functions': [
+        'context', 'clear_context',
+        'get_ids', 'get_structure_dir', 'get_structure_file', 'get_structure',
+        'get_pseudo_dir', 'get_pseudopotentials', 'get_pseudos', 'get_pseudo',
+        'get_production_dir', 'find_production_dir', 'find_calc_dir',
+        'get_workdir', 'make_workdir', 'get_filename', 'make_filename',
+        'make_data_fname', 'make_plot_fname', 'get_datafile', 'resolve_data',
+        ],
+    'util': ['ScanResult'],
+    'nodeid': ['NodeID'],
+    }
+
+_locations = {name: module for module, names in _exports.items()
+              for name in names}
+
+__all__ = ['util', 'cli_functions'] + list(_locations)
+
+
+def _check_exports(module):
+    """Make sure that all the names of helper_functions are exported."""
+    if module.__name__ != __name__ + '.helper_functions':
+        return
+    exported, public = set(_exports['helper_functions']), set(module.__all__)
+    if exported != public:
+        raise ImportError(f'The names of {module.__name__} differ from '
+                          f'its __all__: {sorted(exported ^ public)}')
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module('.' + name, __name__)
+    if name in _locations:
+        module = importlib.import_module('.' + _locations[name], __name__)
+        _check_exports(module)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | set(_submodules))
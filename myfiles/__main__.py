@@ -1,9 +1,15 @@
 import sys
-from textwrap import dedent
 from argparse import ArgumentParser
 from .cli_functions import get_cli_functions
 
-def command_line_execution():
+def find_command_name(argv):
+    """Return the first argument that is not an option, if any."""
+    for arg in argv:
+        if not arg.startswith('-'):
+            return arg
+    return None
+
+def command_line_execution(argv=None):
 
     parser = ArgumentParser(
         prog='myfiles', 
@@ -16,12 +22,26 @@ def command_line_execution():
     #    help="""Print command but don't do it.""",
     #    )
 
+    parser.add_argument(
+        '-y', '--yes', action='store_true',
+        help="""Answer yes to every confirmation, for non-interactive use.""",
+        )
+
     subparsers = parser.add_subparsers(title='command', required=True)
     
-    for func in get_cli_functions():
+    # Only build the parser of the requested command, if it is known.
+    # Otherwise, build them all for the help message.
+    functions = get_cli_functions()
+    name = find_command_name(sys.argv[1:] if argv is None else argv)
+    selected = [func for func in functions if type(func).__name__ == name]
+    for func in (selected or functions):
         func.add_parser(subparsers)
 
-    args, other_args = parser.parse_known_args()
+    args, other_args = parser.parse_known_args(argv)
+
+    if args.yes:
+        from .util import set_assume_yes
+        set_assume_yes()
 
     return args.func(args)
 
@@ -71,6 +71,15 @@ class CLIfunctionWithID(CLIfunction):
         parser.add_argument('ids', type=str, nargs='+', help='Node ID.')
         return parser
 
+class CLIfunctionWithThreads(CLIfunction):
+    """Base class for functions that scan directories."""
+
+    def add_parser(self, sub):
+        parser = super().add_parser(sub)
+        parser.add_argument('-j', '--threads', type=int, default=0,
+                            help='Number of threads to scan directories.')
+        return parser
+
 class CLIfunctionWithRsync(CLIfunction):
     """Base class for functions that operate on a node ID."""
 
@@ -92,6 +101,39 @@ class CLIfunctionWithRsync(CLIfunction):
             )
         return kwargs
 
+    @staticmethod
+    def get_exit_status(result):
+        """The exit status of a transfer, 0 if it was not confirmed."""
+        return int(result is not None and not result.success)
+
+
+class CLIfunctionWithBatch(CLIfunctionWithID):
+    """Base class for functions that transfer the files of many nodes."""
+
+    def add_parser(self, sub):
+        parser = super().add_parser(sub)
+        parser.add_argument('-b', '--batch', action='store_true',
+                            help='Each argument is a node ID, e.g. 1-2 1-3.')
+        parser.add_argument('-u', '--under', action='store_true',
+                            help='Transfer every node found locally '
+                                 'under the ID, one at a time.')
+        parser.add_argument('-j', '--jobs', type=int, default=4,
+                            help='Number of concurrent transfers.')
+        parser.add_argument('-p', '--plan', action='store_true',
+                            help='Dry-run rsync once for all the nodes, '
+                                 'and only transfer those with changes.')
+        return parser
+
+    def get_batch_kwargs(self, args):
+        """Return the arguments of Project.transfer_batch, or None."""
+        from .nodeid import NodeID
+        if args.batch:
+            return dict(ids_list=args.ids, jobs=args.jobs, plan=args.plan)
+        if args.under:
+            return dict(prefix=NodeID(args.ids), jobs=args.jobs,
+                        plan=args.plan)
+        return None
+
 
 class CLIfunctionWithRemote(CLIfunctionWithRsync):
     """Base class for functions that operate on a remote host."""
@@ -105,12 +147,8 @@ class CLIfunctionWithRemote(CLIfunctionWithRsync):
 # Functions
 # =========================================================================== #
 
-from .config import UserConfig, ProjectConfig, RemoteHosts
-from .nodeid import NodeID
-from .node import Node
-from .project import Project
-from .util import ScanResult
-from .data import DataDirs
+# Each function imports the modules it needs when called,
+# so that the command line starts quickly.
 
 # =========================================================================== #
 """
@@ -121,12 +159,14 @@ Each function below is callable from command line.
 class check_remote(CLIfunction):
     """Print out remote hosts."""
     def __call__(self, args):
+        from .config import RemoteHosts
         rh = RemoteHosts()
         print(rh)
 
 class check_user_config(CLIfunction):
     """Print out user configuration."""
     def __call__(self, args):
+        from .config import UserConfig
         rc = UserConfig()
         print(rc)
         if not rc.file_exists:
@@ -136,6 +176,7 @@ class check_user_config(CLIfunction):
 class check_project_config(CLIfunction):
     """Print out project configuration."""
     def __call__(self, args):
+        from .config import ProjectConfig
         rc = ProjectConfig()
         print(rc)
         if not rc.file_exists:
@@ -154,32 +195,61 @@ class check_config(CLIfunction):
 class check_project(CLIfunction):
     """Display project information."""
     def __call__(self, args):
+        from .project import Project
         proj = Project()
         print(proj) 
     
-class check_node(CLIfunctionWithID):
+class check_node(CLIfunctionWithID, CLIfunctionWithThreads):
     """Print out information about a node."""
 
     def __call__(self, args):
+        from .node import Node
         node = Node(ids=args.ids)
         if node:
-            node.scan()
+            node.scan(threads=args.threads)
             print(node)
         else:
             print(node.ids)
 
 class nodes(CLIfunction):
     """Display list of nodes."""
+
+    def add_parser(self, sub):
+        from .node import NodeStatus
+        from .index import ProjectIndex
+        parser = super().add_parser(sub)
+        parser.add_argument('ids', type=str, nargs='?', default=None,
+                            help='Only show nodes under these ids, e.g. 3-2.')
+        parser.add_argument('-s', '--status', type=str, action='append',
+                            choices=[s.name for s in NodeStatus],
+                            help='Only show nodes with this status.')
+        parser.add_argument('--in', type=str, action='append', default=[],
+                            dest='present', choices=ProjectIndex.roots,
+                            help='Only show nodes present in this location.')
+        parser.add_argument('--not-in', type=str, action='append', default=[],
+                            dest='absent', choices=ProjectIndex.roots,
+                            help='Only show nodes absent from this location.')
+        parser.add_argument('--export', action='store_true',
+                            help='Also write the displayed nodes as JSON.')
+        return parser
+
     def __call__(self, args):
+        from .project import Project
         proj = Project()
-        proj.read_database()
+        locations = {where: True for where in args.present}
+        locations.update({where: False for where in args.absent})
+        proj.read_database(ids=args.ids, status=args.status, **locations)
         print(proj.node_database) 
+        if args.export:
+            proj.export_database()
+            print(f'Wrote {proj.config.node_database_fname}')
     
-class update(CLIfunction):
-    """Display list of nodes."""
+class update(CLIfunctionWithThreads):
+    """Scan the project and display the updated list of nodes."""
     def __call__(self, args):
+        from .project import Project
         proj = Project()
-        proj.read_database()
+        proj.update_database(threads=args.threads)
         print(proj.node_database) 
     
 class init(CLIfunction):
@@ -194,51 +264,114 @@ class init(CLIfunction):
         return parser
 
     def __call__(self, args):
+        from .project import Project
         return Project.new_project(args.name_or_path)
 
 # =========================================================================== #
 
-class pull_remote(CLIfunctionWithID, CLIfunctionWithRemote):
+class pull_remote(CLIfunctionWithBatch, CLIfunctionWithRemote):
     """Pull files from a remote host."""
     def __call__(self, args):
+        from .project import Project
         proj = Project()
         kwargs = self.get_rsync_kwargs(args)
-        proj.pull_production_dir(args.hostname, args.ids, **kwargs)
-
-class push_remote(CLIfunctionWithID, CLIfunctionWithRemote):
+        if batch_kwargs := self.get_batch_kwargs(args):
+            batch = proj.transfer_batch('pull_remote', hostname=args.hostname,
+                                        **batch_kwargs, **kwargs)
+            return int(not batch.success)
+        result = proj.pull_production_dir(args.hostname, args.ids, **kwargs)
+        return self.get_exit_status(result)
+
+class push_remote(CLIfunctionWithBatch, CLIfunctionWithRemote):
     """Push files to a remote host."""
     def __call__(self, args):
+        from .project import Project
         proj = Project()
         kwargs = self.get_rsync_kwargs(args)
-        proj.push_production_dir(args.hostname, args.ids, **kwargs)
-
-class pull_scratch(CLIfunctionWithID, CLIfunctionWithRsync):
+        if batch_kwargs := self.get_batch_kwargs(args):
+            batch = proj.transfer_batch('push_remote', hostname=args.hostname,
+                                        **batch_kwargs, **kwargs)
+            return int(not batch.success)
+        result = proj.push_production_dir(args.hostname, args.ids, **kwargs)
+        return self.get_exit_status(result)
+
+class pull_scratch(CLIfunctionWithBatch, CLIfunctionWithRsync):
     """Pull files from scratch directory."""
     def __call__(self, args):
+        from .project import Project
         proj = Project()
         kwargs = self.get_rsync_kwargs(args)
-        proj.pull_scratch(args.ids, **kwargs)
-
-class push_scratch(CLIfunctionWithID, CLIfunctionWithRsync):
+        if batch_kwargs := self.get_batch_kwargs(args):
+            batch = proj.transfer_batch('pull_scratch',
+                                        **batch_kwargs, **kwargs)
+            return int(not batch.success)
+        result = proj.pull_scratch(args.ids, **kwargs)
+        return self.get_exit_status(result)
+
+class push_scratch(CLIfunctionWithBatch, CLIfunctionWithRsync):
     """Push files to scratch directory."""
     def __call__(self, args):
+        from .project import Project
         proj = Project()
         kwargs = self.get_rsync_kwargs(args)
-        proj.push_scratch(args.ids, **kwargs)
+        if batch_kwargs := self.get_batch_kwargs(args):
+            batch = proj.transfer_batch('push_scratch',
+                                        **batch_kwargs, **kwargs)
+            return int(not batch.success)
+        result = proj.push_scratch(args.ids, **kwargs)
+        return self.get_exit_status(result)
 
 class push_local_data(CLIfunctionWithRemote):
     """Push local data to a remote host."""
     def __call__(self, args, **kwargs):
+        from .project import Project
         proj = Project()
         kwargs = self.get_rsync_kwargs(args)
-        proj.push_local_data(args.hostname, **kwargs)
+        result = proj.push_local_data(args.hostname, **kwargs)
+        return self.get_exit_status(result)
 
 class push_global_data(CLIfunctionWithRemote):
     """Push global data to a remote host."""
     def __call__(self, args, **kwargs):
+        from .project import Project
+        proj = Project()
+        kwargs = self.get_rsync_kwargs(args)
+        result = proj.push_global_data(args.hostname, **kwargs)
+        return self.get_exit_status(result)
+
+class diff_remote(CLIfunctionWithRemote):
+    """Compare the nodes of a remote host with the local ones, listed at once."""
+
+    def add_parser(self, sub):
+        parser = super().add_parser(sub)
+        parser.add_argument('ids', type=str, nargs='?', default='',
+                            help='Only compare nodes under these ids, e.g. 3-2.')
+        parser.add_argument('--pull', action='store_true',
+                            help='Pull the nodes that are remote only or changed.')
+        parser.add_argument('--push', action='store_true',
+                            help='Push the nodes that are local only or changed.')
+        parser.add_argument('-j', '--jobs', type=int, default=4,
+                            help='Number of concurrent transfers.')
+        return parser
+
+    def __call__(self, args):
+        from .project import Project
         proj = Project()
         kwargs = self.get_rsync_kwargs(args)
-        proj.push_global_data(args.hostname, **kwargs)
+        if args.hostname not in proj.remote:
+            raise Exception(f'Unknown host: {args.hostname}')
+        with proj.remote.connection(args.hostname):
+            diff = proj.diff_remote(args.hostname, args.ids)
+            print(diff.get_report())
+            success = True
+            for kind, ids_list in (('pull_remote', args.pull and diff.to_pull),
+                                   ('push_remote', args.push and diff.to_push)):
+                if ids_list:
+                    batch = proj.transfer_batch(kind, ids_list=ids_list,
+                                                hostname=args.hostname,
+                                                jobs=args.jobs, **kwargs)
+                    success = success and batch.success
+        return int(not success)
 
 # =========================================================================== #
 # Moving data
@@ -247,19 +380,33 @@ class push_global_data(CLIfunctionWithRemote):
 class make_anadir(CLIfunctionWithID):
     """Create a directory in analysis folder to match one in the production folder."""
     def __call__(self, args):
+        from .node import Node
         node = Node(args.ids)
         node.make_analysis_dir(verbose=True)
 
 
-class save_results(CLIfunction):
-    """Create a directory in analysis folder to match one in the production folder."""
+class save_results(CLIfunctionWithThreads):
+    """Copy the new or changed files of the analysis folder to the results folder."""
+
+    def add_parser(self, sub):
+        parser = super().add_parser(sub)
+        parser.add_argument('-m', '--mode', default='auto',
+                            choices=['auto', 'copy', 'link'],
+                            help='How to copy files: auto uses reflinks or '
+                                 'in-kernel copies on the same filesystem, '
+                                 'link makes hard links.')
+        return parser
+
     def __call__(self, args):
+        from .project import Project
         project = Project()
-        project.copy_analysis_files_to_results()
+        project.copy_analysis_files_to_results(threads=args.threads,
+                                               mode=args.mode)
 
 
 class scratchlink(CLIfunction):
     """Create a directory in analysis folder to match one in the production folder."""
     def __call__(self, args):
+        from .project import Project
         project = Project()
         project.make_scratch_link()
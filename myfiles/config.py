@@ -1,36 +1,130 @@
+import os
 from pathlib import Path
 import configparser
 from copy import copy, deepcopy
-import json
+from types import MappingProxyType
+from contextlib import contextmanager
 import abc
 
 from .util import prompt_user_and_run, run_command, prompt_user_confirmation
 
+__all__ = ['Config', 'UserConfig', 'ProjectConfig', 'NodeConfig', 'RemoteHosts',
+           'read_config_files', 'clear_config_cache']
+
+# Parsed configuration files, shared by all the Config objects of the process,
+# by names of the files read, along with their modification times and sizes,
+# so that the files are parsed again only when one of them changes.
+_config_cache = dict()
+
+# Possible configuration files of each directory, most specific first.
+_candidates_cache = dict()
+
+# Configurations shared by the whole process, by class and directory,
+# along with the state of the files they were read from.
+_snapshots = dict()
+
+
+def _get_state(fnames):
+    """The modification times and sizes of the files that exist."""
+    state = []
+    for fname in fnames:
+        try:
+            stat = os.stat(fname)
+        except OSError:
+            continue
+        state.append((str(fname), stat.st_mtime_ns, stat.st_size))
+    return tuple(state)
+
+
+def read_config_files(fnames):
+    """
+    Return the sections of some configuration files, as read by configparser,
+    as an immutable mapping. Files that do not exist are ignored.
+    """
+    state = _get_state(fnames)
+    key = tuple(fname for fname, _, _ in state)
+
+    cached = _config_cache.get(key)
+    if cached is not None and cached[0] == state:
+        return cached[1]
+
+    config = configparser.ConfigParser()
+    config.read(list(key))
+    sections = MappingProxyType({
+        sk: MappingProxyType(dict(config[sk]))
+        for sk in config.sections()})
+    _config_cache[key] = (state, sections)
+    return sections
+
+
+def clear_config_cache():
+    """Forget all configuration files read."""
+    _config_cache.clear()
+    _candidates_cache.clear()
+    _snapshots.clear()
+
+
 class Config(dict, abc.ABC):
 
     _config_filename = '.myfilesrc'
 
     def __init__(self, path='.', read=True, **kwargs):
         super().__init__()
-        self.update(self.defaults)
+        defaults = self.defaults
+        self.update(defaults)
         self.update(kwargs)
         self.files_read = []
 
         if not read:
-            return self
+            return
 
         fnames = self.find_all_config_files(path)
 
         self.files_read.extend(fnames)
 
-        config = configparser.ConfigParser()
-        config.read(fnames)
-        for sk in self.defaults:
-            for key in self.defaults[sk]:
-                try:
-                    self[sk][key] = config[sk][key]
-                except KeyError:
-                    continue
+        config = read_config_files(fnames)
+        for sk in defaults:
+            if sk not in config:
+                continue
+            section = config[sk]
+            for key in defaults[sk]:
+                if key in section:
+                    self[sk][key] = section[key]
+
+    @classmethod
+    def snapshot(cls, path='.'):
+        """
+        Return a configuration shared by the whole process,
+        which cannot be modified.
+        It is read again only when one of its files changes.
+        """
+        workdir = Path(path).expanduser().absolute()
+        key = (cls, str(workdir), str(Path().absolute()))
+        state = _get_state(cls.find_all_config_files(workdir))
+        cached = _snapshots.get(key)
+        if cached is not None and cached[0] == state:
+            return cached[1]
+
+        config = cls(path=workdir)
+        config._freeze()
+        _snapshots[key] = (state, config)
+        return config
+
+    def _freeze(self):
+        for sk, section in self.items():
+            if isinstance(section, dict):
+                dict.__setitem__(self, sk, MappingProxyType(section))
+        self.frozen = True
+
+    def __setitem__(self, key, value):
+        if getattr(self, 'frozen', False):
+            raise Exception('A shared configuration cannot be modified.')
+        super().__setitem__(key, value)
+
+    def update(self, *args, **kwargs):
+        if getattr(self, 'frozen', False):
+            raise Exception('A shared configuration cannot be modified.')
+        super().update(*args, **kwargs)
 
     def __str__(self):
         S  = ''
@@ -43,7 +137,8 @@ class Config(dict, abc.ABC):
             S += str(Path(fname).absolute()) + '\n'
         S += n*'-' + '\n'
 
-        d = json.dumps(dict(self))
+        import json
+        d = json.dumps({sk: dict(section) for sk, section in self.items()})
         json_object = json.loads(d)
         S += json.dumps(json_object, indent=2) + '\n'
         S += n*'=' + '\n'
@@ -59,23 +154,33 @@ class Config(dict, abc.ABC):
         return Path('~').expanduser().absolute()
 
     @classmethod
-    def find_all_config_files(cls, workdir):
+    def _find_config_candidates(cls, workdir):
+        """
+        Return the paths where a configuration file may be found
+        for a directory, from the directory itself up to home.
+        """
+        key = (cls._config_filename, str(workdir))
+        candidates = _candidates_cache.get(key)
+        if candidates is not None:
+            return candidates
+
         home = Path('~').expanduser().absolute()
-        fnames = []
-        workdir = Path(workdir).expanduser().absolute()
-        p = workdir / cls._config_filename
-        if p.exists():
-            fnames.append(str(p))
+        candidates = [str(workdir / cls._config_filename)]
         for parent in workdir.parents:
-            p = parent / cls._config_filename
-            if p.exists():
-                fnames.append(str(p))
+            candidates.append(str(parent / cls._config_filename))
             if parent.resolve() == home.resolve():
                 break
         if home not in workdir.parents and home != workdir:
-            p = home / cls._config_filename
-            if p.exists():
-                fnames.append(str(p))
+            candidates.append(str(home / cls._config_filename))
+
+        _candidates_cache[key] = candidates
+        return candidates
+
+    @classmethod
+    def find_all_config_files(cls, workdir):
+        workdir = Path(workdir).expanduser().absolute()
+        fnames = [fname for fname in cls._find_config_candidates(workdir)
+                  if os.path.exists(fname)]
         fnames.reverse()
         return fnames
 
@@ -134,6 +239,7 @@ class UserConfig(Config):
         'Data': {
             'structure' : 'Structures',
             'pseudo' : 'Pseudos',
+            'duplicates' : 'first',
             },
         }
 
@@ -162,10 +268,28 @@ class UserConfig(Config):
     def global_scratch_data(self):
         return self.global_scratch / self.global_data.relative_to(self.home)
 
+    @property
+    def cache_dir(self):
+        """Directory of the catalogs of directories shared by all projects."""
+        cache = os.environ.get('XDG_CACHE_HOME') or '~/.cache'
+        return Path(cache).expanduser().absolute() / 'myfiles'
+
     @property
     def node_database_fname(self):
         return self.topdir / '.nodes.json'
 
+    @property
+    def node_sqlite_fname(self):
+        return self.topdir / '.nodes.sqlite'
+
+    @property
+    def node_index_fname(self):
+        return self.topdir / '.index.json'
+
+    @property
+    def results_manifest_fname(self):
+        return self.topdir / '.results.json'
+
     def make_global_dirs(self):
         todo = []
         for directory in (self.projectsdir,
@@ -322,9 +446,9 @@ class NodeConfig(ProjectConfig):
 
     @property
     def defaults(self):
-        d = dict(self.user_defaults)
-        d.update(self.project_defaults)
-        d.update(self.node_defaults)
+        d = deepcopy(self.user_defaults)
+        d.update(deepcopy(self.project_defaults))
+        d.update(deepcopy(self.node_defaults))
         return d
 
 
@@ -344,18 +468,10 @@ class RemoteHosts(Config):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self['RemoteHosts']['hosts'] = []
-        
-        # Manual parsing!
-        sshconfig = Path('~/.ssh/config').expanduser().absolute()
-        if sshconfig.exists():
-            with open(str(sshconfig), 'r') as f:
-                for line in f.readlines():
-                    if line.startswith('Host'):
-                        parts = line.split()
-                        if len(parts) > 1:
-                            self['RemoteHosts']['hosts'].append(parts[1])
-            self.files_read.append(sshconfig)
+        from .sshconfig import read_ssh_config
+        self.ssh_config = read_ssh_config()
+        self['RemoteHosts']['hosts'] = self.ssh_config.hosts
+        self.files_read.extend(self.ssh_config.files_read)
 
     def find_all_config_files(self, path):
         return []
@@ -369,7 +485,107 @@ class RemoteHosts(Config):
         return self['RemoteHosts']['hosts']
 
     def __contains__(self, hostname):
-        return (hostname in self.hosts)
+        return (hostname in self.hosts or hostname in self.ssh_config)
+
+    def get_host_config(self, hostname) -> dict:
+        """The ssh settings of a host, e.g. hostname, user, controlpath."""
+        return self.ssh_config.lookup(hostname)
+
+    # Share one ssh connection per host between consecutive commands,
+    # kept open for control_persist seconds after the last one.
+    multiplex = True
+    control_persist = 600
+
+    @property
+    def control_dir(self):
+        """Directory of the sockets of the shared ssh connections."""
+        return self.home / '.ssh' / 'myfiles'
+
+    def make_control_dir(self):
+        """
+        Create the directory of the sockets, private to the user.
+        Refuse a directory that another user could control.
+        """
+        import stat
+        path = self.control_dir
+        path.parent.mkdir(mode=0o700, exist_ok=True)
+        try:
+            path.mkdir(mode=0o700)
+        except FileExistsError:
+            pass
+        st = os.lstat(path)
+        if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid()
+                or st.st_mode & 0o077):
+            raise Exception(f'Unsafe directory for ssh sockets: {path}\n'
+                            'It must be a directory owned by you, '
+                            'with mode 700, and not a symlink.')
+        return path
+
+    def get_ssh_options(self, hostname=None):
+        """
+        Options of ssh to share a connection per host.
+        None are needed for a host whose ssh configuration
+        already sets a ControlPath.
+        """
+        if not self.multiplex:
+            return []
+        if (hostname is not None
+                and 'controlpath' in self.get_host_config(hostname)):
+            return []
+        self.make_control_dir()
+        # %C is a hash of the connection, short enough for a socket path.
+        return ['-o', 'ControlMaster=auto',
+                '-o', f'ControlPath={self.control_dir}/%C',
+                '-o', f'ControlPersist={self.control_persist}']
+
+    def get_rsh(self, hostname=None):
+        """The remote shell of rsync, or None to use the default ssh."""
+        options = self.get_ssh_options(hostname)
+        if not options:
+            return None
+        import shlex
+        return shlex.join(['ssh'] + options)
+
+    def check_connection(self, hostname):
+        """True if a shared connection to a host is open."""
+        if not self.multiplex:
+            return False
+        result = run_command(['ssh'] + self.get_ssh_options(hostname)
+                             + ['-O', 'check', hostname], echo=False)
+        return result.success
+
+    def open_connection(self, hostname):
+        """
+        Open a shared connection to a host, in the background,
+        unless one is open already.
+        Authentication happens here, once, in the terminal.
+        Return True if a new connection was opened.
+        """
+        if not self.multiplex or self.check_connection(hostname):
+            return False
+        result = run_command(['ssh'] + self.get_ssh_options(hostname)
+                             + ['-M', '-N', '-f', hostname], capture=False)
+        return result.success
+
+    def close_connection(self, hostname):
+        """Close the shared connection to a host."""
+        if not self.multiplex:
+            return
+        run_command(['ssh'] + self.get_ssh_options(hostname)
+                    + ['-O', 'exit', hostname], echo=False)
+
+    @contextmanager
+    def connection(self, hostname, close=True):
+        """
+        Share one ssh connection to a host within a block.
+        If close is True, a connection opened here is closed at the end.
+        """
+        opened = self.open_connection(hostname)
+        try:
+            yield self
+        finally:
+            if opened and close:
+                self.close_connection(hostname)
     
     def write(self, fname):
         return
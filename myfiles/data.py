@@ -3,15 +3,24 @@ from pathlib import Path
 
 from .util import ScanResult
 from .config import UserConfig, ProjectConfig
+from .pseudos import get_catalog
+from .index import get_filename_index
+
+__all__ = ['DataDir', 'DataDirs']
 
 class DataDir:
     """A single data directory, containing subdirectories and files."""
 
-    def __init__(self, dirname, config):
-        self.config = config or ProjectConfig()
+    def __init__(self, dirname, config, duplicates=None):
+        self.config = config or ProjectConfig.snapshot()
         self.dirname = Path(dirname).expanduser().absolute()
         self.pseudo_subdir = '.'
 
+        # Which file to return when several have the same name,
+        # see FilenameIndex.
+        self.duplicates = (duplicates
+                           or self.config['Data'].get('duplicates', 'first'))
+
     def __str__(self):
         return f"Datadir({self.dirname})"
 
@@ -23,6 +32,18 @@ class DataDir:
     def structure_dir(self):
         return self.dirname / self.config['Data']['structure']
 
+    @property
+    def pseudo_catalog_fname(self):
+        """The catalog file, kept outside of the data directory."""
+        import hashlib
+        digest = hashlib.sha1(str(self.pseudo_dir).encode()).hexdigest()
+        return self.config.cache_dir / f'pseudos-{digest[:16]}.json'
+
+    @property
+    def pseudo_catalog(self):
+        """The catalog of the pseudopotential directory."""
+        return get_catalog(self.pseudo_dir, self.pseudo_catalog_fname)
+
     def get_pseudo_dirs(self, keywords=('pbe','psp8','sr')):
         """
         Return a list of pseudopotential directories that exist
@@ -37,36 +58,9 @@ class DataDir:
                 matching_paths.append(self.pseudo_dir.absolute())
             return matching_paths
 
-        directories = []
-        counts = []
-        # GA: Temporarily backtracking to python 3.11 compatible version.
-        #for (dirpath, dirnames, filenames) in self.pseudo_dir.walk():
-        for root, dirnames, filenames in os.walk(str(self.pseudo_dir)):
-            dirpath = Path(root)
-            if not dirnames:
-                continue
-            for dirname in dirnames:
-                n = 0
-                for kw in keywords:
-                    if kw.lower() in dirname.lower():
-                        n += 1
-                directories.append(dirpath / dirname)
-                counts.append(n)
-
-        if not directories:
-            return matching_paths
-
-        nmax = max(counts)
-        #if nmax < len(keywords):
-        #    print(nmax, len(keywords))
-        #    #raise Exception('Did not find pseudo directory matching keywords.')
-        #    return matching_paths
-
-        for dirpath, n in zip(directories, counts):
-            if n == nmax:
-                matching_paths.append(dirpath.absolute())
-                #path = dirpath
-                #break
+        # Subdirectories with the largest number of keywords.
+        for dirpath in self.pseudo_catalog.match(keywords):
+            matching_paths.append(Path(dirpath))
 
         #subdir = subdir or self.pseudo_subdir
         #path = self.pseudo_dir / subdir
@@ -91,6 +85,19 @@ class DataDir:
         """
         Return a list or dictionary of pseudopotential files.
         """
+        return self.get_pseudopotential_sets(
+            [psps], keywords=keywords, path=path,
+            as_dict=as_dict, basename=basename)[0]
+
+    def get_pseudopotential_sets(self, psp_sets:[[str]],
+                                 keywords=('pbe','psp8','sr'),
+                                 path=None,
+                                 as_dict=False,
+                                 basename=False) -> [([str], [ScanResult])]:
+        """
+        Return the pseudopotential files of several sets of elements,
+        searching the pseudopotential directories only once.
+        """
 
         if path is None:
             paths = self.get_pseudo_dirs(keywords=keywords)
@@ -104,38 +111,61 @@ class DataDir:
             except:
                 raise Exception('Invalid type for path: {}'.format(type(path)))
 
-        N = len(psps)
-        elements = [os.path.splitext(str(psp))[0] for psp in psps]
-        pseudos = dict()
-        results = []
-
-        for element in elements:
-            fname = ''
-            res = ScanResult.failure
-
-            for path in paths:
-                search = path.glob(f'{element}.*')
-                try:
-                    filepath = next(search)
-                except StopIteration:
-                    continue
-
-                if basename:
-                    fname = filepath.name
-                    res = ScanResult.success
-                    break
-                else:
-                    fname = str(filepath.absolute())
-                    res = ScanResult.success
-                    break
-
-            pseudos[element] = fname
-            results.append(res)
-
-        if not as_dict:
-            pseudos = list(pseudos.values())
-
-        return pseudos, results
+        # Explicit paths do not need the whole directory to be walked.
+        if path is None:
+            catalog = self.pseudo_catalog
+        else:
+            catalog = get_catalog(self.pseudo_dir, scan=False)
+        found = self._find_pseudopotentials(psp_sets, paths, catalog,
+                                            as_dict, basename)
+
+        # Directories created since the last walk may hold the missing ones.
+        if path is None and any(ScanResult.failure in results
+                                for _, results in found):
+            if catalog.refresh().nlisted:
+                paths = self.get_pseudo_dirs(keywords=keywords)
+                found = self._find_pseudopotentials(psp_sets, paths, catalog,
+                                                    as_dict, basename)
+
+        return found
+
+    @staticmethod
+    def _find_pseudopotentials(psp_sets, paths, catalog, as_dict, basename):
+        files = [catalog.elements(path) for path in paths]
+
+        found = []
+        for psps in psp_sets:
+            elements = [os.path.splitext(str(psp))[0] for psp in psps]
+            pseudos = dict()
+            results = []
+
+            for element in elements:
+                fname = ''
+                res = ScanResult.failure
+
+                for path, path_files in zip(paths, files):
+                    name = path_files.get(element)
+                    if name is None:
+                        continue
+
+                    if basename:
+                        fname = name
+                        res = ScanResult.success
+                        break
+                    else:
+                        fname = str(path / name)
+                        res = ScanResult.success
+                        break
+
+                pseudos[element] = fname
+                results.append(res)
+
+            if not as_dict:
+                pseudos = list(pseudos.values())
+
+            found.append((pseudos, results))
+
+        return found
 
     def get_structure_dir(self):
         """
@@ -155,16 +185,11 @@ class DataDir:
         #    raise Exception(f'File not found: {path}')
         #return str(path.absolute())
 
-        # GA: Temporarily backtracking to python 3.11 compatible version.
-        #for (dirpath, dirnames, filenames) in self.structure_dir.walk():
-        dirpath = None
-        for root, dirnames, filenames in os.walk(str(self.structure_dir)):
-            dirpath = Path(root)
-            for fname in filenames:
-                if fname == filename:
-                    return ScanResult.success, (dirpath / filename)
-
-        return ScanResult.failure, str(dirpath)
+        index = get_filename_index(self.structure_dir)
+        path = index.find_file(filename, self.duplicates)
+        if path is None:
+            return ScanResult.failure, str(self.structure_dir)
+        return ScanResult.success, Path(path)
 
     def get_datafile(self, filename) -> (ScanResult, Path):
         """
@@ -175,15 +200,11 @@ class DataDir:
         #    raise Exception(f'File not found: {path}')
         #return str(path.absolute())
 
-        # GA: Temporarily backtracking to python 3.11 compatible version.
-        #for (dirpath, dirnames, filenames) in self.structure_dir.walk():
-        for root, dirnames, filenames in os.walk(str(self.dirname)):
-            dirpath = Path(root)
-            for fname in filenames:
-                if fname == filename:
-                    return ScanResult.success, (dirpath / filename)
-
-        return ScanResult.failure, dirpath
+        index = get_filename_index(self.dirname)
+        path = index.find_file(filename, self.duplicates)
+        if path is None:
+            return ScanResult.failure, str(self.dirname)
+        return ScanResult.success, Path(path)
 
 
 class DataDirs(list):
@@ -192,12 +213,12 @@ class DataDirs(list):
     in order of decreasing priority.
     """
 
-    def __init__(self, config=None):
+    def __init__(self, config=None, duplicates=None):
         super().__init__()
-        self.config = config or ProjectConfig()
+        self.config = config or ProjectConfig.snapshot()
         for dirname in (
                 self.config.local_data, self.config.global_data):
-            self.append(DataDir(dirname, self.config))
+            self.append(DataDir(dirname, self.config, duplicates))
 
     def set_pseudo_subdir(self, subdir='.'):
         for datadir in self:
@@ -235,27 +256,11 @@ class DataDirs(list):
                              as_dict=False,
                              basename=False) -> [str]:
 
-        N = len(psps)
-        elements = [os.path.splitext(str(psp))[0] for psp in psps]
-        pseudos = dict()
-        results = N * [ScanResult.failure]
-
-        for datadir in self:
-            ps, res = datadir.get_pseudopotentials(
-                psps=psps, keywords=keywords, path=path,
-                as_dict=True, basename=basename)
-
-            for i, el in enumerate(elements):
-                if (results[i] == ScanResult.failure
-                    and res[i] == ScanResult.success):
-
-                    pseudos[el] = ps[el]
-                    results[i] = ScanResult.success
-
-            if all([r == ScanResult.success for r in results]):
-                break
+        [(pseudos, results)] = self.get_pseudopotential_sets(
+            [psps], keywords=keywords, path=path,
+            as_dict=as_dict, basename=basename)
 
-        if any([r == ScanResult.failure for r in results]):
+        if ScanResult.failure in results:
 
             # Get some info for debugging
             if path is not None:
@@ -275,11 +280,105 @@ class DataDirs(list):
                 msg += f'{d} \n'
             raise Exception(msg)
 
-        if not as_dict:
-            pseudos = list(pseudos.values())
-
         return pseudos
 
+    def get_pseudopotential_sets(self, psp_sets:[[str]],
+                                 keywords=('pbe','psp8','sr'),
+                                 path=None,
+                                 as_dict=False,
+                                 basename=False) -> [([str], [ScanResult])]:
+        """
+        Find the pseudopotential files of several sets of elements.
+        Return a (pseudos, results) pair for each set, as would
+        DataDir.get_pseudopotential_sets, where missing pseudopotentials
+        are empty strings.
+        """
+        sets = [list(psps) for psps in psp_sets]
+        pseudos = [dict() for psps in sets]
+        results = [len(psps) * [ScanResult.failure] for psps in sets]
+
+        for datadir in self:
+            todo = [j for j, res in enumerate(results)
+                    if ScanResult.failure in res]
+            if not todo:
+                break
+
+            found = datadir.get_pseudopotential_sets(
+                [sets[j] for j in todo], keywords=keywords, path=path,
+                as_dict=True, basename=basename)
+
+            for j, (ps, res) in zip(todo, found):
+                for i, psp in enumerate(sets[j]):
+                    el = os.path.splitext(str(psp))[0]
+                    if (results[j][i] == ScanResult.failure
+                        and res[i] == ScanResult.success):
+
+                        pseudos[j][el] = ps[el]
+                        results[j][i] = ScanResult.success
+
+        found = []
+        for psps, ps, res in zip(sets, pseudos, results):
+            elements = [os.path.splitext(str(psp))[0] for psp in psps]
+            ps = {el: ps.get(el, '') for el in elements}
+            if not as_dict:
+                ps = list(ps.values())
+            found.append((ps, res))
+
+        return found
+
+    def _find_files(self, filenames, where):
+        """
+        Find several files by basename, in the directory
+        given by the attribute `where` of each data directory.
+        """
+        found = len(filenames) * [(ScanResult.no_scan, None)]
+        for datadir in self:
+            todo = [i for i, (result, _) in enumerate(found)
+                    if result != ScanResult.success]
+            if not todo:
+                break
+
+            index = get_filename_index(getattr(datadir, where))
+            paths = index.find_files([filenames[i] for i in todo],
+                                     datadir.duplicates)
+            for i, path in zip(todo, paths):
+                if path is None:
+                    found[i] = (ScanResult.failure, None)
+                else:
+                    found[i] = (ScanResult.success, Path(path))
+
+        return found
+
+    def get_structure_files(self, filenames) -> [(ScanResult, Path)]:
+        """Find several structure files, with one lookup per data directory."""
+        return self._find_files(list(filenames), 'structure_dir')
+
+    def get_datafiles(self, filenames) -> [(ScanResult, Path)]:
+        """Find several data files, with one lookup per data directory."""
+        return self._find_files(list(filenames), 'dirname')
+
+    def resolve(self, structures=(), datafiles=(), pseudos=(),
+                keywords=('pbe','psp8','sr'), **kwargs) -> dict:
+        """
+        Find many structures, data files and sets of pseudopotentials at once.
+
+        Return a dictionary with the keys 'structures', 'datafiles'
+        and 'pseudos', each with a list in the order of the items requested:
+        (ScanResult, path) for the files, and (pseudos, [ScanResult])
+        for the sets of pseudopotentials.
+        Other keyword arguments are passed to get_pseudopotential_sets.
+
+        Example:
+            > DataDirs().resolve(structures=['Si.cif', 'GaAs.cif'],
+                                 pseudos=[['Si'], ['Ga', 'As']])
+        """
+        return dict(
+            structures=self.get_structure_files(structures),
+            datafiles=self.get_datafiles(datafiles),
+            pseudos=self.get_pseudopotential_sets(
+                pseudos, keywords=keywords, **kwargs),
+            )
+
     def get_structure_dir(self):
         for datadir in self:
             try:
@@ -306,7 +405,7 @@ class DataDirs(list):
             result, filepath = datadir.get_datafile(filename)
             if result == ScanResult.success:
                 return result, filepath
-        return result, self.dirname
+        return result, None
         #if result == ScanResult.no_scan:
         #    raise Exception('No data directory to scan.')
         #else:
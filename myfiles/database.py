@@ -0,0 +1,188 @@
+"""
+SQLite storage of the nodes of a project.
+"""
+import json
+import sqlite3
+
+from .nodeid import NodeID
+from .node import Node, NodeStatus, NodeDatabase
+
+__all__ = ['NodeSQLiteDatabase']
+
+
+class NodeSQLiteDatabase:
+    """
+    Nodes stored in an SQLite file, one row per node,
+    with indices on the ids, the status and the locations of the node.
+    """
+
+    locations = ('production', 'analysis', 'results')
+
+    # Width of each id in the sortable key.
+    _keywidth = 9
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS nodes (
+            key TEXT PRIMARY KEY,
+            ids TEXT NOT NULL,
+            name TEXT,
+            status INTEGER NOT NULL,
+            production INTEGER NOT NULL,
+            analysis INTEGER NOT NULL,
+            results INTEGER NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS nodes_status ON nodes (status, key);
+        CREATE INDEX IF NOT EXISTS nodes_location
+            ON nodes (production, analysis, results, key);
+    """
+
+    def __init__(self, fname, **kwargs):
+        """Keyword arguments are passed to each Node read."""
+        self.fname = str(fname)
+        self.node_kwargs = kwargs
+        self._connection = None
+
+    def __str__(self):
+        return f'NodeSQLiteDatabase({self.fname})'
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.fname)
+            self._connection.executescript(self._schema)
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @classmethod
+    def make_key(cls, ids) -> str:
+        """A key whose alphabetical order follows the ids."""
+        n = cls._keywidth
+        return ''.join(f'{int(i):0{n}d}-' for i in ids)
+
+    def _make_row(self, node):
+        D = node.to_dict()
+        return (self.make_key(node.ids),
+                D.pop('ids'),
+                D.pop('name'),
+                D.pop('status'),
+                int(bool(node.production_directories or node.production_files)),
+                int(bool(node.analysis_directories or node.analysis_files)),
+                int(bool(node.results_directories or node.results_files)),
+                json.dumps(D, sort_keys=True),
+                )
+
+    def _node_from_row(self, row):
+        ids, name, status, data = row
+        D = json.loads(data)
+        D.update(ids=ids, name=name, status=status)
+        return Node.from_dict(D, **self.node_kwargs)
+
+    def __len__(self):
+        cursor = self.connection.execute('SELECT COUNT(*) FROM nodes')
+        return cursor.fetchone()[0]
+
+    def write(self, nodes, remove_others=False):
+        """
+        Insert or update the rows of some nodes in a single transaction.
+        Only the rows that changed are written.
+        If remove_others is True, delete the nodes that are not given.
+        """
+        rows = {}
+        for node in nodes:
+            row = self._make_row(node)
+            rows[row[0]] = row
+
+        with self.connection as con:
+            existing = dict(
+                (r[0], r) for r in con.execute('SELECT * FROM nodes'))
+
+            changed = [row for key, row in rows.items()
+                       if existing.get(key) != row]
+            con.executemany(
+                'INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                changed)
+
+            if remove_others:
+                removed = [(key,) for key in existing if key not in rows]
+                con.executemany('DELETE FROM nodes WHERE key = ?', removed)
+
+        return len(changed)
+
+    def remove(self, ids):
+        with self.connection as con:
+            con.execute('DELETE FROM nodes WHERE key = ?',
+                        (self.make_key(NodeID(ids)),))
+
+    def query(self, ids=None, status=None, **locations) -> NodeDatabase:
+        """
+        Return the nodes under some ids, optionally with a given status,
+        and present or absent in some locations, e.g.
+
+            query('3-2', production=True, analysis=False)
+        """
+        clauses = []
+        values = []
+
+        if ids is not None:
+            if isinstance(ids, str):
+                ids = NodeID.from_str(ids)
+            key = self.make_key(ids)
+            if key:
+                # All keys starting with the prefix.
+                clauses.append('key >= ? AND key < ?')
+                values.extend([key, key[:-1] + '.'])
+
+        if status is not None:
+            if isinstance(status, (NodeStatus, str, int)):
+                status = [status]
+            status = [NodeStatus[s] if isinstance(s, str) else NodeStatus(s)
+                      for s in status]
+            clauses.append(
+                'status IN (' + ', '.join(len(status) * '?') + ')')
+            values.extend([s.value for s in status])
+
+        for where, present in locations.items():
+            if where not in self.locations:
+                raise TypeError(f'Unknown location: {where}')
+            if present is None:
+                continue
+            clauses.append(f'{where} = ?')
+            values.append(int(bool(present)))
+
+        command = 'SELECT ids, name, status, data FROM nodes'
+        if clauses:
+            command += ' WHERE ' + ' AND '.join(clauses)
+        command += ' ORDER BY key'
+
+        nodes = NodeDatabase()
+        for row in self.connection.execute(command, values):
+            nodes.append(self._node_from_row(row))
+        return nodes
+
+    def read(self) -> NodeDatabase:
+        """Return all the nodes."""
+        return self.query()
+
+    def export_json(self, fname):
+        """Write all the nodes in the list format of NodeDatabase."""
+        nodes = self.read()
+        nodes.write(fname)
+        return nodes
+
+    def import_json(self, fname):
+        """Read nodes written in the list format of NodeDatabase."""
+        nodes = NodeDatabase()
+        nodes.read(fname, **self.node_kwargs)
+        self.write(nodes)
+        return nodes
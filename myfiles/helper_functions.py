@@ -7,6 +7,67 @@ from .project import Project
 from .util import ScanResult
 from .data import DataDirs
 
+__all__ = [
+    'context', 'clear_context',
+    'get_ids', 'get_structure_dir', 'get_structure_file', 'get_structure',
+    'get_pseudo_dir', 'get_pseudopotentials', 'get_pseudos', 'get_pseudo',
+    'get_production_dir', 'find_production_dir', 'find_calc_dir',
+    'get_workdir', 'make_workdir', 'get_filename', 'make_filename',
+    'make_data_fname', 'make_plot_fname', 'get_datafile', 'resolve_data',
+    ]
+
+class Context:
+    """
+    The configuration, project and data directories of a working directory,
+    shared by the helper functions.
+    """
+
+    def __init__(self, path='.'):
+        self.path = Path(path).expanduser().absolute()
+        self.config = ProjectConfig.snapshot(self.path)
+        self._project = None
+        self._datadirs = None
+
+    @property
+    def is_valid(self):
+        """False if the shared configuration was read again since."""
+        return ProjectConfig.snapshot(self.path) is self.config
+
+    @property
+    def project(self):
+        if self._project is None:
+            self._project = Project(config=self.config)
+        return self._project
+
+    @property
+    def datadirs(self):
+        if self._datadirs is None:
+            self._datadirs = DataDirs(config=self.config)
+        return self._datadirs
+
+
+# Contexts in use, by working directory.
+_contexts = dict()
+
+def context(path=None) -> Context:
+    """
+    Return the context of a working directory, the current one by default.
+    A context is created again when a configuration file has changed,
+    or after clear_context.
+    """
+    path = Path(path or '.').expanduser().absolute()
+    ctx = _contexts.get(path)
+    if ctx is None or not ctx.is_valid:
+        ctx = _contexts[path] = Context(path)
+    return ctx
+
+def clear_context(path=None):
+    """Forget the context of a working directory, or all of them."""
+    if path is None:
+        _contexts.clear()
+    else:
+        _contexts.pop(Path(path).expanduser().absolute(), None)
+
 def get_ids(fname=None, n=None):
     """Scan the current file or path name and return ids."""
     ids = NodeID.from_path(fname)
@@ -17,30 +78,31 @@ def get_ids(fname=None, n=None):
 
 def get_structure_dir():
     """Return absolute paths of a structure directory."""
-    return DataDirs().get_structure_dir()
+    return context().datadirs.get_structure_dir()
 
 def get_structure_file(filename):
     """Return absolute paths of a structure."""
-    return DataDirs().get_structure_file(filename)
+    return context().datadirs.get_structure_file(filename)
 
 get_structure = get_structure_file
 
 def get_pseudo_dir(subdir=None, keywords=()):
     """Return absolute paths of a pseudopotential directory."""
-    return DataDirs().get_pseudo_dir(subdir=subdir, keywords=keywords)
+    # The keywords select the directory, subdir is ignored.
+    return context().datadirs.get_pseudo_dir(keywords=keywords)
 
 def get_pseudopotentials(*args, **kwargs):
     """
     Return list of absolute psp paths.
     """
-    return DataDirs().get_pseudopotentials(*args, **kwargs)
+    return context().datadirs.get_pseudopotentials(*args, **kwargs)
 
 get_pseudos = get_pseudopotentials
 get_pseudo = get_pseudopotentials
 
 def get_production_dir(ids=None):
     """Find a production directory matching some ids."""
-    node = Node(ids=ids)
+    node = Node(ids=ids, project=context().project)
     return node.find_production_dir()
 
 find_production_dir = get_production_dir
@@ -52,7 +114,6 @@ def get_workdir(name, ids=None):
         ids = NodeID.from_path()
         if m := len(pids) < len(ids):
             _, ids = ids.partition(m)
-            ids.ndigits = 1
     else:
         ids = NodeID(ids)
 
@@ -124,7 +185,7 @@ def make_plot_fname(ids, where='.', tag='', ext='.pdf', prefix='plot',
 
 
 def get_datafile(filename):
-    data = DataDirs()
+    data = context().datadirs
     result, datafile = data.get_datafile(filename)
     if result == ScanResult.success:
         return datafile
@@ -132,3 +193,12 @@ def get_datafile(filename):
         raise Exception('No data directory to scan.')
     else:
         raise Exception(f'File not found: {filename}')
+
+
+def resolve_data(structures=(), datafiles=(), pseudos=(), **kwargs):
+    """
+    Find many structures, data files and sets of pseudopotentials
+    with a single configuration, see DataDirs.resolve.
+    """
+    return context().datadirs.resolve(
+        structures=structures, datafiles=datafiles, pseudos=pseudos, **kwargs)
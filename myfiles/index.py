@@ -0,0 +1,761 @@
+"""
+Index of the files and directories of a project, grouped by NodeID.
+
+Each root directory (production, analysis, results) is walked once,
+and the scan of any node is then answered from memory.
+"""
+import os
+import json
+import posixpath
+from pathlib import Path
+
+from .nodeid import NodeID, NodeIDTrie
+from .util import list_directory
+
+__all__ = ['RootIndex', 'RemoteRootIndex', 'IndexDiff', 'ProjectIndex',
+           'FilenameIndex', 'get_filename_index']
+
+
+class RootIndex:
+    """
+    All files and directories found under a root directory,
+    grouped by their NodeID.
+
+    The listing of every directory is kept along with its modification time,
+    so that a refresh only lists again the directories that have changed.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root).expanduser().absolute()
+
+        # Map the relative path of each directory to a listing
+        # [mtime_ns, dirnames, filenames, symlinked dirnames].
+        self.dirs = dict()
+
+        # Entries (order, path, is_dir, parent_length) stored by ids.
+        self.entries = NodeIDTrie()
+        self.scanned = False
+
+        # Number of directories listed and reused during the last scan.
+        self.nlisted = 0
+        self.nreused = 0
+
+    def __str__(self):
+        return f'RootIndex({self.root})'
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.dirs = dict()
+        self.entries.clear()
+        self.scanned = False
+
+    def _add(self, ids, path, is_dir, parent_length):
+        entry = (len(self.entries), path, is_dir, parent_length)
+        self.entries.insert(ids, entry)
+
+    def _abspath(self, rel):
+        if rel == '.':
+            return str(self.root)
+        return os.path.join(str(self.root), rel)
+
+    @staticmethod
+    def _relpath(rel, name):
+        if rel == '.':
+            return name
+        return os.path.join(rel, name)
+
+    def _walk(self, start, previous, recursive=True):
+        """
+        List the directories from start, in the same order as
+        a top-down os.walk, without following symlinks.
+        The listing of a directory whose modification time did not change
+        is taken from the previous listings.
+        Return the listings and the numbers of directories listed and reused.
+        """
+        dirs = dict()
+        nlisted = nreused = 0
+        todo = [start]
+        while todo:
+            rel = todo.pop()
+            path = self._abspath(rel)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                listing = previous.get(rel)
+                if listing is not None and listing[0] == mtime:
+                    nreused += 1
+                else:
+                    listing = [mtime, *list_directory(path)]
+                    nlisted += 1
+            except OSError:
+                continue
+
+            dirs[rel] = listing
+            if recursive:
+                todo.extend(reversed(self._subdirs(rel, listing)))
+
+        return dirs, nlisted, nreused
+
+    def _subdirs(self, rel, listing):
+        """The subdirectories to walk into, from a directory listing."""
+        dirnames, links = listing[1], listing[3]
+        return [self._relpath(rel, d) for d in dirnames if d not in links]
+
+    def _submit_subtrees(self, executor, top, previous):
+        """Walk each subdirectory of the root in a separate task."""
+        listing = top[0].get('.')
+        if listing is None:
+            return []
+        return [executor.submit(self._walk, rel, previous)
+                for rel in self._subdirs('.', listing)]
+
+    def _merge(self, walks):
+        """Merge the results of several walks, in order."""
+        self.dirs = dict()
+        self.nlisted = self.nreused = 0
+        for dirs, nlisted, nreused in walks:
+            self.dirs.update(dirs)
+            self.nlisted += nlisted
+            self.nreused += nreused
+        self._make_entries()
+
+    def scan(self, refresh=False, executor=None):
+        """
+        Walk the root directory and record every entry.
+        If refresh is True, the listing of the directories whose
+        modification time did not change are taken from the previous scan.
+        If an executor is given, the subdirectories of the root
+        are walked concurrently.
+        """
+        previous = self.dirs if refresh else dict()
+        if executor is None:
+            self._merge([self._walk('.', previous)])
+        else:
+            top = self._walk('.', previous, recursive=False)
+            futures = self._submit_subtrees(executor, top, previous)
+            self._merge([top] + [future.result() for future in futures])
+        return self
+
+    def refresh(self, executor=None):
+        """Scan again, listing only the directories that changed."""
+        return self.scan(refresh=True, executor=executor)
+
+    def _make_entries(self):
+        """Group the entries of every directory listing by their ids."""
+        self.entries.clear()
+
+        root = str(self.root)
+        root_ids = NodeID._ids_str_from_path(root)
+
+        todo = [('.', root_ids)]
+        while todo:
+            rel, parent_ids = todo.pop()
+            listing = self.dirs.get(rel)
+            if listing is None:
+                continue
+            _, dirnames, filenames, links = listing
+            dirpath = self._abspath(rel)
+
+            # Direct children of the root are always visited.
+            parent_length = 0 if rel == '.' else len(parent_ids)
+
+            for filename in filenames:
+                ids = parent_ids + NodeID._ids_str_from_basename(filename)
+                path = os.path.join(dirpath, filename)
+                self._add(ids, path, False, parent_length)
+
+            subdirs = []
+            for dirname in dirnames:
+                ids = parent_ids + NodeID._ids_str_from_basename(dirname)
+                path = os.path.join(dirpath, dirname)
+                self._add(ids, path, True, parent_length)
+                if dirname not in links:
+                    subdirs.append((self._relpath(rel, dirname), ids))
+
+            todo.extend(reversed(subdirs))
+
+        self.scanned = True
+
+    def iter_top_level(self):
+        """Yield the paths and whether they are directories, for the
+        entries located directly in the root directory."""
+        if not self.scanned:
+            self.scan()
+        listing = self.dirs.get('.')
+        if listing is None:
+            return
+        _, dirnames, filenames, _ = listing
+        for dirname in dirnames:
+            yield os.path.join(str(self.root), dirname), True
+        for filename in filenames:
+            yield os.path.join(str(self.root), filename), False
+
+    def scan_directory(self, ids):
+        """
+        Return the directories and files matching some ids,
+        as would NodeID.scan_directory on the root directory.
+        """
+        if not self.scanned:
+            self.scan()
+
+        n = len(ids)
+        found = []
+        for entry in self.entries.descendants(ids):
+            # Directories deeper than the ids are not walked into.
+            if entry[3] <= n:
+                found.append(entry)
+        found.sort()
+
+        directories = [path + '/' for _, path, is_dir, _ in found if is_dir]
+        files = [path for _, path, is_dir, _ in found if not is_dir]
+        return directories, files
+
+    def find(self, ids):
+        """Return the directories and files whose ids match exactly."""
+        if not self.scanned:
+            self.scan()
+        entries = sorted(self.entries.get(ids))
+        directories = [path + '/' for _, path, is_dir, _ in entries if is_dir]
+        files = [path for _, path, is_dir, _ in entries if not is_dir]
+        return directories, files
+
+    def find_directory(self, ids):
+        """
+        Return the first directory whose ids match exactly, or None.
+        If the directory is not in the index, only the directories
+        whose ids are a prefix of the ids are listed.
+        """
+        if self.scanned:
+            directories, _ = self.find(ids)
+            if directories:
+                return directories[0]
+
+        target = tuple(int(i) for i in ids)
+        root = str(self.root)
+        root_ids = tuple(int(i) for i in NodeID._ids_str_from_path(root))
+
+        # Same order as the entries of a scan: every directory listed
+        # is searched before the subdirectories that it contains.
+        todo = [(root, root_ids)]
+        while todo:
+            dirpath, parent_ids = todo.pop()
+            if parent_ids != target[:len(parent_ids)]:
+                continue
+            try:
+                dirnames, _, links = list_directory(dirpath)
+            except OSError:
+                continue
+
+            subdirs = []
+            for dirname in dirnames:
+                dir_ids = parent_ids + tuple(
+                    int(i) for i in NodeID._ids_str_from_basename(dirname))
+                path = os.path.join(dirpath, dirname)
+                if dir_ids == target:
+                    return path + '/'
+                if dirname not in links:
+                    subdirs.append((path, dir_ids))
+
+            todo.extend(reversed(subdirs))
+
+        return None
+
+    def file_stats(self, rel) -> dict:
+        """
+        Map the path of every file under a directory, relative to the root,
+        to its size and modification time in seconds, without following
+        symlinks, as rsync would compare them.
+        Only the listings under the directory are visited.
+        """
+        if not self.scanned:
+            self.scan()
+        stats = dict()
+        todo = [rel]
+        while todo:
+            rel = todo.pop()
+            listing = self.dirs.get(rel)
+            if listing is None:
+                continue
+            for filename in listing[2]:
+                path = self._relpath(rel, filename)
+                try:
+                    stat = os.lstat(self._abspath(path))
+                except OSError:
+                    continue
+                stats[path] = (stat.st_size, stat.st_mtime_ns // 10**9)
+            todo.extend(reversed(self._subdirs(rel, listing)))
+        return stats
+
+    def nearest_ancestor(self, ids):
+        """Return the ids and paths of the closest entries above some ids."""
+        if not self.scanned:
+            self.scan()
+        key, entries = self.entries.nearest_ancestor(ids)
+        return key, [path for _, path, _, _ in sorted(entries)]
+
+    def to_dict(self):
+        return dict(root=str(self.root), dirs=self.dirs)
+
+    @classmethod
+    def from_dict(cls, D):
+        new = cls(D['root'])
+        new.dirs = {rel: list(listing) for rel, listing in D['dirs'].items()}
+        new._make_entries()
+        return new
+
+
+class RemoteRootIndex(RootIndex):
+    """
+    All files and directories found under a root directory on a remote host,
+    listed with a single find command over ssh.
+
+    The entries are grouped by the ids of the matching local root,
+    so that the nodes can be compared with those of a local index,
+    while their paths are those of the remote host.
+    """
+
+    # Type, type of the symlink target, size, mtime and relative path.
+    _format = '%y %Y %s %T@ %P\\0'
+
+    def __init__(self, root, hostname, remote_root, ssh_options=()):
+        super().__init__(root)
+        self.hostname = hostname
+        self.remote_root = str(remote_root).rstrip('/') or '/'
+        self.ssh_options = list(ssh_options)
+
+        # Size and modification time of the files, by relative path,
+        # grouped by the directory or file at the top of the root.
+        self.stats = dict()
+
+    def __str__(self):
+        return f'RemoteRootIndex({self.hostname}:{self.remote_root})'
+
+    def _abspath(self, rel):
+        if rel == '.':
+            return self.remote_root
+        return posixpath.join(self.remote_root, rel)
+
+    @staticmethod
+    def _relpath(rel, name):
+        if rel == '.':
+            return name
+        return posixpath.join(rel, name)
+
+    def get_command_parts(self):
+        """The ssh command listing the remote root directory."""
+        import shlex
+        command = shlex.join(['find', self.remote_root,
+                              '-printf', self._format])
+        return ['ssh'] + self.ssh_options + [self.hostname, command]
+
+    def scan(self, refresh=False, executor=None):
+        """
+        List the remote root directory with a single command.
+        The whole tree is always listed again.
+        """
+        from .util import run_command
+        result = run_command(self.get_command_parts(), echo=False)
+        if not result.success:
+            raise Exception(f'Could not list {self.hostname}:'
+                            f'{self.remote_root} '
+                            f'(exit status {result.returncode}):\n'
+                            + result.stderr)
+        self.read_listing(result.stdout)
+        return self
+
+    @staticmethod
+    def _read_mtime(mtime):
+        """Read a time in seconds printed by find, in nanoseconds."""
+        seconds, _, fraction = mtime.partition('.')
+        return int(seconds) * 10**9 + int((fraction + '0' * 9)[:9])
+
+    def read_listing(self, text):
+        """
+        Make the directory listings from the output of find,
+        in which every directory comes before its content.
+        """
+        self.dirs = dict()
+        self.stats = dict()
+        for record in text.split('\0'):
+            if not record.strip():
+                continue
+            kind, target_kind, size, mtime, rel = record.split(' ', 4)
+            rel = rel or '.'
+            mtime_ns = self._read_mtime(mtime)
+            if kind == 'd':
+                listing = self.dirs.setdefault(rel, [0, [], [], []])
+                listing[0] = mtime_ns
+            if rel == '.':
+                continue
+
+            parent, name = posixpath.split(rel)
+            listing = self.dirs.setdefault(parent or '.', [0, [], [], []])
+            if target_kind == 'd':
+                listing[1].append(name)
+                if kind == 'l':
+                    listing[3].append(name)
+            else:
+                listing[2].append(name)
+                top = rel.split('/', 1)[0]
+                self.stats.setdefault(top, dict())[rel] = (
+                    int(size), mtime_ns // 10**9)
+
+        self.nlisted = len(self.dirs)
+        self.nreused = 0
+        self._make_entries()
+
+    def file_stats(self, rel) -> dict:
+        if not self.scanned:
+            self.scan()
+        if rel == '.':
+            return {path: stat for group in self.stats.values()
+                    for path, stat in group.items()}
+        top, _, sub = rel.partition('/')
+        group = self.stats.get(top, dict())
+        if not sub:
+            return dict(group)
+        prefix = rel + '/'
+        return {path: stat for path, stat in group.items()
+                if path.startswith(prefix)}
+
+    def find_directory(self, ids):
+        directories, _ = self.find(ids)
+        return directories[0] if directories else None
+
+    def to_dict(self):
+        D = super().to_dict()
+        D.update(hostname=self.hostname, remote_root=self.remote_root,
+                 stats=self.stats)
+        return D
+
+    @classmethod
+    def from_dict(cls, D):
+        new = cls(D['root'], D['hostname'], D['remote_root'])
+        new.dirs = {rel: list(listing) for rel, listing in D['dirs'].items()}
+        new.stats = {top: {path: tuple(stat) for path, stat in group.items()}
+                     for top, group in D['stats'].items()}
+        new._make_entries()
+        return new
+
+
+class IndexDiff:
+    """
+    The nodes found at the top of two indices of the same root directory,
+    e.g. a local one and a remote one, sorted by whether they differ.
+
+    A node found in both is changed if its directories do not hold
+    the same files, with the same sizes and modification times.
+    """
+
+    def __init__(self, local, remote, prefix=()):
+        self.local = local
+        self.remote = remote
+        self.prefix = NodeID(prefix)
+
+        self.local_only = []
+        self.remote_only = []
+        self.changed = []
+        self.unchanged = []
+
+        local_nodes = self._get_nodes(local)
+        remote_nodes = self._get_nodes(remote)
+        for ids in sorted(set(local_nodes) | set(remote_nodes),
+                          key=lambda ids: tuple(ids)):
+            if ids not in remote_nodes:
+                self.local_only.append(ids)
+            elif ids not in local_nodes:
+                self.remote_only.append(ids)
+            elif self._differ(local_nodes[ids], remote_nodes[ids]):
+                self.changed.append(ids)
+            else:
+                self.unchanged.append(ids)
+
+    def _get_nodes(self, index):
+        """The names of the top directories of each node under the prefix."""
+        nodes = dict()
+        for path, is_dir in index.iter_top_level():
+            if not is_dir:
+                continue
+            ids = NodeID.from_path(path)
+            if ids and ids in self.prefix:
+                nodes.setdefault(ids, []).append(os.path.basename(path))
+        return nodes
+
+    def _differ(self, local_names, remote_names):
+        if sorted(local_names) != sorted(remote_names):
+            return True
+        for name in local_names:
+            if self.local.file_stats(name) != self.remote.file_stats(name):
+                return True
+        return False
+
+    @property
+    def to_pull(self):
+        """The nodes that only exist or differ on the remote side."""
+        return self.remote_only + self.changed
+
+    @property
+    def to_push(self):
+        """The nodes that only exist or differ on the local side."""
+        return self.local_only + self.changed
+
+    def get_report(self):
+        S = ''
+        for status, ids_list in (('local only', self.local_only),
+                                 ('remote only', self.remote_only),
+                                 ('changed', self.changed)):
+            for ids in ids_list:
+                S += f'{str(ids):>12}  {status}\n'
+        S += (f'{len(self.local_only)} local only, '
+              f'{len(self.remote_only)} remote only, '
+              f'{len(self.changed)} changed, '
+              f'{len(self.unchanged)} up to date')
+        return S
+
+
+class ProjectIndex:
+    """
+    Index of the production, analysis and results directories of a project.
+    Each root directory is walked only when first needed.
+    """
+
+    roots = ('production', 'analysis', 'results')
+
+    def __init__(self, project):
+        self.project = project
+        self._indices = dict()
+
+        # Index file to read when a root directory is first needed.
+        self._pending = None
+
+    def __getitem__(self, where) -> RootIndex:
+        self._read_pending()
+        if where not in self.roots:
+            raise KeyError(f'Unknown root directory: {where}')
+        if where not in self._indices:
+            self._indices[where] = RootIndex(getattr(self.project, where))
+        return self._indices[where]
+
+    def scan(self, where=None, refresh=False, threads=None):
+        """
+        Walk some root directories, all of them by default.
+        If refresh is True, list only the directories that changed
+        since the last scan.
+        With a number of threads, the roots and their subdirectories
+        are walked concurrently by a pool of threads.
+        """
+        if where is None:
+            where = self.roots
+        elif isinstance(where, str):
+            where = [where]
+
+        indices = dict()
+        for name in where:
+            index = self[name]
+            root = getattr(self.project, name)
+            if not (refresh and index.scanned and index.root == root):
+                index = self._indices[name] = RootIndex(root)
+            indices[name] = index
+
+        if not threads:
+            for index in indices.values():
+                index.scan(refresh=refresh)
+            return self
+
+        # The tasks never wait on each other, so the pool cannot deadlock.
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            previous = {name: index.dirs for name, index in indices.items()}
+            tops = {name: executor.submit(index._walk, '.', previous[name],
+                                          recursive=False)
+                    for name, index in indices.items()}
+            subtrees = {name: indices[name]._submit_subtrees(
+                                executor, top.result(), previous[name])
+                        for name, top in tops.items()}
+            for name, index in indices.items():
+                walks = [tops[name].result()]
+                walks.extend(future.result() for future in subtrees[name])
+                index._merge(walks)
+
+        return self
+
+    def scan_missing(self, threads=None):
+        """Walk the root directories that have not been walked yet."""
+        missing = [name for name in self.roots if not self[name].scanned]
+        if missing:
+            self.scan(missing, threads=threads)
+        return self
+
+    def refresh(self, threads=None):
+        """
+        Walk all the roots again, listing only the directories
+        that changed since the last scan.
+        """
+        return self.scan(refresh=True, threads=threads)
+
+    def clear(self):
+        """Forget everything and walk the roots again when needed."""
+        self._indices = dict()
+        self._pending = None
+
+    def write(self, fname):
+        self._read_pending()
+        D = {where: index.to_dict() for where, index in self._indices.items()
+             if index.scanned}
+        tmpname = str(fname) + '.tmp'
+        with open(tmpname, 'w') as fn:
+            json.dump(D, fn)
+        os.replace(tmpname, str(fname))
+
+    def read_later(self, fname):
+        """Read an index file only when a root directory is first needed."""
+        self.clear()
+        self._pending = fname
+
+    def _read_pending(self):
+        if self._pending is not None:
+            fname, self._pending = self._pending, None
+            if os.path.exists(fname):
+                self.read(fname)
+
+    def read(self, fname):
+        self.clear()
+        with open(str(fname), 'r') as fn:
+            D = json.load(fn)
+        for where, d in D.items():
+            if where in self.roots:
+                self._indices[where] = RootIndex.from_dict(d)
+
+    def scan_directory(self, ids, where):
+        """Return the directories and files of a node in a root directory."""
+        return self[where].scan_directory(ids)
+
+    def scan_production(self, ids):
+        return self.scan_directory(ids, 'production')
+
+    def scan_analysis(self, ids):
+        return self.scan_directory(ids, 'analysis')
+
+    def scan_results(self, ids):
+        return self.scan_directory(ids, 'results')
+
+
+class FilenameIndex(RootIndex):
+    """
+    All files found under a root directory, grouped by their basename.
+
+    When several files share a basename, the one returned
+    depends on a policy:
+        first: The first one found by a top-down walk.
+        shallowest: The one with the fewest parent directories.
+        newest: The one modified last.
+        error: Raise an exception.
+    """
+
+    policies = ('first', 'shallowest', 'newest', 'error')
+
+    def __init__(self, root):
+        super().__init__(root)
+
+        # Paths of the files, by basename, in the order of a top-down walk.
+        self.names = dict()
+
+    def __str__(self):
+        return f'FilenameIndex({self.root})'
+
+    def __len__(self):
+        return sum(len(paths) for paths in self.names.values())
+
+    def clear(self):
+        super().clear()
+        self.names = dict()
+
+    def _make_entries(self):
+        """Group the files of every directory listing by their basename."""
+        self.names = dict()
+        todo = ['.']
+        while todo:
+            rel = todo.pop()
+            listing = self.dirs.get(rel)
+            if listing is None:
+                continue
+            dirpath = self._abspath(rel)
+            for filename in listing[2]:
+                path = os.path.join(dirpath, filename)
+                self.names.setdefault(filename, []).append(path)
+            todo.extend(reversed(self._subdirs(rel, listing)))
+        self.scanned = True
+
+    def find_all(self, filename) -> list:
+        """Return the paths of all the files with a basename."""
+        if not self.scanned:
+            self.scan()
+        return list(self.names.get(filename, []))
+
+    def _choose(self, paths, duplicates):
+        if duplicates not in self.policies:
+            raise Exception(f'Unknown policy for duplicates: {duplicates}')
+        if len(paths) == 1 or duplicates == 'first':
+            return paths[0]
+        if duplicates == 'shallowest':
+            return min(paths, key=lambda path: path.count(os.sep))
+        if duplicates == 'newest':
+            # Files removed in the meantime are dropped from the index.
+            mtimes = dict()
+            for path in list(paths):
+                try:
+                    mtimes[path] = os.stat(path).st_mtime_ns
+                except FileNotFoundError:
+                    paths.remove(path)
+            return max(mtimes, key=mtimes.get) if mtimes else None
+        S = f'Found {len(paths)} files named {os.path.basename(paths[0])}:\n'
+        S += '\n'.join(paths)
+        raise Exception(S)
+
+    def find_file(self, filename, duplicates='first'):
+        """
+        Return the path of a file from its basename, or None.
+        If the file is not found, or no longer exists,
+        the directories that changed are listed again.
+        """
+        return self.find_files([filename], duplicates)[0]
+
+    def find_files(self, filenames, duplicates='first') -> list:
+        """
+        Return the paths of several files from their basenames,
+        or None for the files not found.
+        If some files are not found, or no longer exist,
+        the directories that changed are listed again, only once.
+        """
+        if not self.scanned:
+            self.scan()
+
+        def lookup(filename):
+            paths = self.names.get(filename)
+            if paths and not os.path.exists(paths[0]):
+                # Files removed since the scan are dropped from the index.
+                paths[:] = [path for path in paths if os.path.exists(path)]
+            return paths or None
+
+        found = [lookup(filename) for filename in filenames]
+        if any(paths is None for paths in found):
+            self.refresh()
+            found = [paths or lookup(filename)
+                     for filename, paths in zip(filenames, found)]
+
+        return [None if paths is None else self._choose(paths, duplicates)
+                for paths in found]
+
+
+# Filename indices in use, by root directory.
+_filename_indices = dict()
+
+
+def get_filename_index(root) -> FilenameIndex:
+    """Return the filename index of a directory, kept for the process."""
+    root = Path(root).expanduser().absolute()
+    index = _filename_indices.get(root)
+    if index is None:
+        index = _filename_indices[root] = FilenameIndex(root)
+    return index
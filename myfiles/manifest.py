@@ -0,0 +1,226 @@
+"""
+Manifest of the files copied from the analysis to the results directory.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+
+__all__ = ['CopyManifest', 'copy_file']
+
+# Ways of copying a file, see copy_file.
+copy_modes = ('auto', 'copy', 'link')
+
+# ioctl request of Linux to share the blocks of a file (reflink).
+_FICLONE = 0x40049409
+
+
+def _reflink(source, target):
+    import fcntl
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+
+
+def _copy_file_range(source, target):
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        remaining = os.fstat(src.fileno()).st_size
+        while remaining > 0:
+            sent = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+            if sent == 0:
+                raise OSError(f'copy_file_range stopped before the end of '
+                              f'{source}')
+            remaining -= sent
+
+
+def copy_file(source, target, mode='auto') -> str:
+    """
+    Copy a file, with its permissions, and return the method used.
+
+    Modes
+    -----
+    auto: On the same filesystem, share the blocks of the file (reflink)
+          where supported, or else copy within the kernel (copy_file_range).
+          Otherwise, copy the content.
+    copy: Copy the content.
+    link: Make a hard link, so that the target is the same file as the source.
+    """
+    if mode not in copy_modes:
+        raise Exception(f'Unknown copy mode: {mode}')
+
+    if mode == 'link':
+        os.link(source, target)
+        return 'link'
+
+    if mode == 'auto':
+        target_dir = os.path.dirname(os.path.abspath(target))
+        if os.stat(source).st_dev == os.stat(target_dir).st_dev:
+            for method, function in (('reflink', _reflink),
+                                     ('copy_file_range', _copy_file_range)):
+                if method == 'copy_file_range' and not hasattr(
+                        os, 'copy_file_range'):
+                    continue
+                try:
+                    function(source, target)
+                except (OSError, ImportError):
+                    continue
+                shutil.copymode(source, target)
+                return method
+
+    shutil.copy(source, target)
+    return 'copy'
+
+
+class CopyManifest(dict):
+    """
+    The files copied, by source path, as [size, mtime_ns, hash, target].
+
+    A source file is hashed only when its size or modification time changed,
+    and copied again only when its content changed.
+    """
+
+    def __init__(self, fname=None):
+        super().__init__()
+        self.fname = fname
+        self.modified = False
+
+        # Protects the records and counters from concurrent copies.
+        self._lock = threading.Lock()
+
+        # Files and bytes copied, and time spent, by copy_files.
+        self.ncopied = 0
+        self.nbytes = 0
+        self.elapsed = 0.
+        if fname is not None and os.path.exists(fname):
+            self.read(fname)
+
+    @staticmethod
+    def hash_file(path, blocksize=1 << 20):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as fn:
+            for block in iter(lambda: fn.read(blocksize), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _record(self, source, stat, digest, target, copied=False):
+        with self._lock:
+            self[source] = [stat.st_size, stat.st_mtime_ns, digest, target]
+            self.modified = True
+            if copied:
+                self.ncopied += 1
+                self.nbytes += stat.st_size
+
+    def copy(self, source, target, verbose=True, mode='auto') -> bool:
+        """
+        Copy a file, unless the target is up to date.
+        A target that was not copied from this source
+        is never overwritten. See copy_file for the modes.
+        Return True if the file was copied.
+        """
+        source, target = str(source), str(target)
+        stat = os.stat(source)
+        with self._lock:
+            entry = self.get(source)
+        known = entry is not None and entry[3] == target
+        target_exists = os.path.exists(target)
+
+        if (known and target_exists and entry[0] == stat.st_size
+                and entry[1] == stat.st_mtime_ns):
+            return False
+
+        digest = self.hash_file(source)
+        if target_exists:
+            if known:
+                up_to_date = (entry[2] == digest)
+            else:
+                up_to_date = (os.path.getsize(target) == stat.st_size
+                              and self.hash_file(target) == digest)
+                if not up_to_date:
+                    return False
+            if up_to_date:
+                self._record(source, stat, digest, target)
+                return False
+
+        # The target is replaced only once it is complete.
+        dirname, basename = os.path.split(target)
+        fd, tmpname = tempfile.mkstemp(prefix='.' + basename + '.',
+                                       suffix='.tmp', dir=dirname or '.')
+        os.close(fd)
+        try:
+            if mode == 'link':
+                os.remove(tmpname)
+            method = copy_file(source, tmpname, mode=mode)
+            os.replace(tmpname, target)
+        except BaseException:
+            if os.path.lexists(tmpname):
+                os.remove(tmpname)
+            raise
+
+        if verbose:
+            print(f'Copying ({method}): {source} --> {target}')
+
+        self._record(source, stat, digest, target, copied=True)
+        return True
+
+    @staticmethod
+    def _unique_targets(pairs, verbose=True):
+        """Yield the pairs as they come, skipping the targets already seen."""
+        seen = dict()
+        for source, target in pairs:
+            source, target = str(source), str(target)
+            if target in seen:
+                if verbose:
+                    print(f'Not copying {source}: {target} is the target '
+                          f'of {seen[target]}')
+                continue
+            seen[target] = source
+            yield source, target
+
+    def copy_files(self, pairs, threads=None, verbose=True, mode='auto'):
+        """
+        Copy the files of some (source, target) pairs that are not
+        up to date, with a pool of threads if a number of threads is given.
+        When several sources have the same target, only the first one
+        is copied, as the others would not overwrite it.
+        Return the number of files copied.
+        """
+        pairs = self._unique_targets(pairs, verbose)
+        ncopied = self.ncopied
+        start = time.perf_counter()
+        if threads:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                futures = [executor.submit(self.copy, source, target,
+                                           verbose=verbose, mode=mode)
+                           for source, target in pairs]
+                for future in futures:
+                    future.result()
+        else:
+            for source, target in pairs:
+                self.copy(source, target, verbose=verbose, mode=mode)
+        self.elapsed += time.perf_counter() - start
+        return self.ncopied - ncopied
+
+    def get_report(self):
+        S = f'{self.ncopied} files copied, '
+        S += f'{self.nbytes} bytes in {self.elapsed:.1f} s'
+        if self.elapsed > 0:
+            S += f' ({self.nbytes / self.elapsed / 1e6:.2f} MB/s)'
+        return S
+
+    def read(self, fname):
+        with open(str(fname), 'r') as fn:
+            self.update(json.load(fn))
+
+    def write(self, fname=None):
+        """Write the manifest, if it changed."""
+        fname = fname or self.fname
+        if fname is None or not self.modified:
+            return
+        tmpname = str(fname) + '.tmp'
+        with open(tmpname, 'w') as fn:
+            json.dump(self, fn)
+        os.replace(tmpname, str(fname))
+        self.modified = False
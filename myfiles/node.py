@@ -1,11 +1,11 @@
 import enum
+import os
 from pathlib import Path
 import shutil
 from .config import UserConfig, ProjectConfig, NodeConfig, RemoteHosts
 from .nodeid import NodeID
 from .util import prompt_user_and_run
 import json
-import subprocess
 
 __all__ = ['Node']
 
@@ -19,8 +19,15 @@ class Node:
     """
     def __init__(self, ids=None, config=None, project=None):
 
+        if project is None:
+            from .project import Project
+            self.project = Project()
+        else:
+            self.project = project
+
+        # Nodes of a project share the same configuration.
         if config is None:
-            self.config = NodeConfig()
+            self.config = self.project.node_config
         else:
             self.config = config
 
@@ -31,12 +38,6 @@ class Node:
         else:
             self.ids = NodeID(ids)
 
-        if project is None:
-            from .project import Project
-            self.project = Project()
-        else:
-            self.project = project
-
         # Sub nodes
         self.nodes = []
 
@@ -116,12 +117,16 @@ class Node:
         S += n*'=' + '\n'
         return S
 
-    def scan(self):
+    def scan(self, threads=None):
         """
         Find all files and directories belonging to this node.
         Those files must have arbitrary names, but their id
         structure must match those of the node or its subnodes.
+        With a number of threads, the production, analysis and results
+        directories are walked concurrently.
         """
+        if threads:
+            self.project.index.scan_missing(threads=threads)
         self.scan_production()
         self.scan_analysis()
         self.scan_results()
@@ -131,7 +136,7 @@ class Node:
         Look for matching files and directories in project's production dir.
         """
         self.production_directories, self.production_files = (
-            self.ids.scan_directory(self.project.production)
+            self.project.index.scan_production(self.ids)
             )
 
     def scan_analysis(self):
@@ -139,7 +144,7 @@ class Node:
         Look for matching files and directories in project's analysis dir.
         """
         self.analysis_directories, self.analysis_files = (
-            self.ids.scan_directory(self.project.analysis)
+            self.project.index.scan_analysis(self.ids)
             )
 
     def scan_results(self):
@@ -147,70 +152,72 @@ class Node:
         Look for matching files and directories in project's results dir.
         """
         self.results_directories, self.results_files = (
-            self.ids.scan_directory(self.project.results)
+            self.project.index.scan_results(self.ids)
             )
 
-    def copy_analysis_files_to_results(self, exclude=('.py',), verbose=True):
+    def iter_results_copies(self, exclude=('.py',)):
         """
-        Look for files produced in analysis directory and copy them to
-        the results directory.
+        Yield the (source, target) pairs of the files of the analysis
+        directory to be copied to the results directory, as they are found.
         """
         if isinstance(exclude, str):
             exclude = [exclude]
-        files_to_copy = []
-        # ---------------------
-        # GA: Temporarily backtracking to python 3.11 compatible version.
-        #for (dirpath, dirnames, filenames) in self.analysis.walk():
-        for root, dirnames, filenames in os.walk(str(self.analysis)):
-            dirpath = Path(root)
-        # ---------------------
-
-            for filename in filenames:
-                skip = False
-                for ext in exclude:
-                    if filename.endswith(ext):
-                        skip = True
-                        break
-                if skip:
-                    continue
-
-                files_to_copy.append(dirpath / filename)
-
-        for filename in files_to_copy:
-            ids = NodeID.from_path(filename)
-            name = ids.strip_ids(filename)
-            results_filename = ids.make_filename(name)
-            source = filename
-            target = self.project.results / results_filename
-            if not target.exists():
-                print(f'Copying: {source} --> {target}')
-                shutil.copy(source, target)
-
-        return
 
+        for entry in NodeID().iter_directory(self.analysis,
+                                               prune=False):
+            if entry.is_dir:
+                continue
+            if any(entry.path.endswith(ext) for ext in exclude):
+                continue
+
+            name = entry.ids.strip_ids(entry.path)
+            results_filename = entry.ids.make_filename(name)
+            yield entry.path, self.project.results / results_filename
+
+    def copy_analysis_files_to_results(self, exclude=('.py',), verbose=True,
+                                       manifest=None, threads=None,
+                                       mode='auto'):
+        """
+        Look for files produced in analysis directory and copy them to
+        the results directory.
+        Only the files that are new or changed since the last copy
+        are copied, as recorded in a CopyManifest.
+        With a number of threads, files are copied concurrently.
+        See manifest.copy_file for the modes of copy.
+        Return the number of files copied.
+        """
+        from .manifest import CopyManifest
+
+        write = manifest is None
+        if manifest is None:
+            manifest = CopyManifest(
+                self.project.config.results_manifest_fname)
+
+        # The files copied are recorded even if a copy fails.
+        try:
+            ncopied = manifest.copy_files(self.iter_results_copies(exclude),
+                                          threads=threads, verbose=verbose,
+                                          mode=mode)
+        finally:
+            if write:
+                manifest.write()
+
+        return ncopied
 
     def find_production_dir(self):
         """
         Search for a production directory in node that matches exactly
         some ids or the node's ids.
         """ 
-        if not self.production_directories:
-            self.scan_production()
-
-        found = []
-        for path in self.production_directories:
-            pathID = NodeID.from_path(path)
+        found = self.project.index['production'].find_directory(self.ids)
 
-            if pathID == self.ids:
-                found.append(str(path))
-
-        if not found:
+        if found is None:
             S = f'Did not find any production directory matching: {self.ids}\n'
             S += f'Project production directory: {self.project.production}\n'
             S += f'Node production directory: {self.production_directories}\n'
             raise Exception(S)
 
-        return found[0]
+        return found
 
     def find_name(self):
         """
@@ -241,32 +248,43 @@ class Node:
     _save_attr = (
             'production_directories',
             'production_files',
-            'analysis_directories'
-            'analysis_files'
-            'results_directories'
-            'results_files'
+            'analysis_directories',
+            'analysis_files',
+            'results_directories',
+            'results_files',
         )
 
+    def find_status(self):
+        """Set the status of the node from the directories and files found."""
+        if self.results_directories or self.results_files:
+            self.status = NodeStatus.Staged
+        elif self.analysis_directories or self.analysis_files:
+            self.status = NodeStatus.Analyzed
+        elif self.production_directories or self.production_files:
+            self.status = NodeStatus.Production
+        else:
+            self.status = NodeStatus.Initialized
+        return self.status
+
     def to_dict(self):
-        # Configuration should not be stored.
+        # Configuration and project should not be stored.
         D = dict()
         D['ids'] = str(self.ids)
-        D['project'] = self.project.to_dict()
+        D['name'] = self._name
 
         for name in self._save_attr:
-            D.update(getattr(self, name))
+            D[name] = list(getattr(self, name))
 
         D['status'] = self.status.value
         return D
 
     @classmethod
-    def from_dict(cls, D):
-        from .project import Project
-        ids = cls(D.pop('ids'))
-        project = Project.from_dict(D.pop('project'))
-        new = cls(ids, project=project))
-        for name in self._save_attr:
-            setattr(name, D.get(name))
+    def from_dict(cls, D, **kwargs):
+        ids = NodeID.from_str(D['ids'])
+        new = cls(ids, **kwargs)
+        new.name = D.get('name', new._name)
+        for name in cls._save_attr:
+            setattr(new, name, list(D.get(name, [])))
         new.status = NodeStatus(D['status'])
         return new
 
@@ -295,24 +313,34 @@ class NodeStatus(enum.Enum):
     Updated = 7
 
 class NodeDatabase(list):
-    """A list of dictionaries"""
+    """A list of nodes, stored as a list of dictionaries."""
 
-    def write(self, fname)
+    def write(self, fname):
         L = []
         for node in self:
             L.append(node.to_dict())
 
-        with open(fname, 'w') as fn:
+        # Write to a temporary file first, so that the database
+        # is never left half-written.
+        tmpname = str(fname) + '.tmp'
+        with open(tmpname, 'w') as fn:
             json.dump(L, fn)
+        os.replace(tmpname, str(fname))
 
-    def read(self, fname):
+    def read(self, fname, **kwargs):
+        """Read the nodes. Keyword arguments are passed to each Node."""
         self.clear()
         L = []
         with open(fname, 'r') as fn:
-            L.extend(list(json.read(fn)))
+            L.extend(list(json.load(fn)))
+
+        # All the nodes share one project.
+        if kwargs.get('project') is None:
+            from .project import Project
+            kwargs['project'] = Project()
 
         for nd in L:
-            self.append(Node.from_dict(nd))
+            self.append(Node.from_dict(nd, **kwargs))
 
     def get_table_string(self):
 
@@ -322,14 +350,14 @@ class NodeDatabase(list):
             if len(L) == 1:
                 return str(L[0])
             else:
-                return ('{len(L)} {name}'
+                return f'{len(L)} {name}'
 
         def files_or_dirs(files: list, dirs: list):
             if not files and not dirs:
                 return ''
-            if files and dirs:
+            if dirs:
                 return item_or_numitem(dirs, 'directories')
-            elif files:
+            else:
                 return item_or_numitem(files, 'files')
 
         from prettytable import PrettyTable, TableStyle
@@ -337,13 +365,13 @@ class NodeDatabase(list):
         table.field_names = ('ID', 'Production', 'Analysis', 'Results', 'Status')
         for node in self:
             row = [str(node.ids),
-                   str(node.status),
                    files_or_dirs(node.production_files,
                                  node.production_directories),
                    files_or_dirs(node.analysis_files,
                                  node.analysis_directories),
-                   files_or_dirs(node.results_directories,
-                                 node.results_files),
+                   files_or_dirs(node.results_files,
+                                 node.results_directories),
+                   node.status.name,
                    ]
             table.add_row(row)
 
@@ -352,4 +380,4 @@ class NodeDatabase(list):
         return table.get_string()
 
     def __str__(self):
-        return self.get_table()
+        return self.get_table_string()
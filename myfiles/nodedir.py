@@ -1,8 +1,7 @@
 from pathlib import Path
 import shutil
 from .config import UserConfig, ProjectConfig, NodeConfig, RemoteHosts
-from .nodeid import NodeID
-import subprocess
+from .nodeid import NodeID, NodeIDTrie
 
 __all__ = ['NodeDir']
 
@@ -16,29 +15,50 @@ class NodeDir:
         self.filename = self.path / '.myfilerc'
 
         self.nodes = []  # A list of NodeID objects.
+        self.tree = NodeIDTrie()  # The paths of the nodes, by ids.
         self.creation_date = []
         self.discovery_date = []
 
     def scan(self):
         if self.nodes:
             self.nodes = []
+            self.tree.clear()
         for item in self.path.iterdir():
             if item.is_symlink():
                 continue
 
-            node = NodeID.from_path(self.path)
+            node = NodeID.from_path(item)
             if node:
                 self.nodes.append(node)
+                self.tree.insert(node, item)
 
         return self.nodes
 
     def __iter__(self):
-        if not self.noderegistry:
+        if not self.nodes:
             self.scan()
 
-        for id in self.noderegistry:
+        for id in self.nodes:
             yield id
 
+    def find(self, ids):
+        """Return the paths of the nodes matching exactly some ids."""
+        if not self.nodes:
+            self.scan()
+        return self.tree.get(ids)
+
+    def find_descendants(self, ids):
+        """Return the paths of the nodes under some ids."""
+        if not self.nodes:
+            self.scan()
+        return self.tree.descendants(ids)
+
+    def find_parent(self, ids):
+        """Return the ids and paths of the closest node above some ids."""
+        if not self.nodes:
+            self.scan()
+        return self.tree.nearest_ancestor(ids)
+
     #def display(self):
     #    pass
 
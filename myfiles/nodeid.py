@@ -1,32 +1,83 @@
 import os
+import weakref
 from pathlib import Path
 from itertools import zip_longest
+from functools import lru_cache
+from collections import namedtuple
+from collections.abc import Sequence
 
-class NodeID(list):
-    """A sequence of digits identifying a node."""
+from .util import walk
+
+# A file or directory found by NodeID.iter_directory.
+NodeEntry = namedtuple('NodeEntry', ['path', 'is_dir', 'ids'])
+
+
+class NodeID(Sequence):
+    """
+    A sequence of digits identifying a node.
+
+    NodeIDs are immutable and hashable, and identical ones are shared:
+    constructing the same ids twice returns the same object.
+    """
     sep = '-'
 
-    def __init__(self, ids: [int | str]):
+    __slots__ = ('_ids', '_mindigits', '_mindigits_all', '__weakref__')
 
-        self._mindigits = []
-        self.mindigits_all = 1
+    # Existing instances, by ids and padding.
+    _instances = weakref.WeakValueDictionary()
 
+    def __new__(cls, ids: [int | str] = ()):
         if isinstance(ids, int) or isinstance(ids, str):
             ids = [ids]
+        mindigits = tuple(len(str(i)) for i in ids)
+        return cls._make(tuple(int(i) for i in ids), mindigits, 1)
 
-        self.mindigits = [len(str(i)) for i in ids]
-
-        super().__init__([int(i) for i in ids])
+    @classmethod
+    def _make(cls, ids: tuple, mindigits: tuple, mindigits_all: int):
+        """Return the instance with these ids and padding."""
+        mindigits = tuple(mindigits[:len(ids)])
+        key = (cls, ids, mindigits, mindigits_all)
+        self = cls._instances.get(key)
+        if self is None:
+            self = object.__new__(cls)
+            object.__setattr__(self, '_ids', ids)
+            object.__setattr__(self, '_mindigits', mindigits)
+            object.__setattr__(self, '_mindigits_all', mindigits_all)
+            cls._instances[key] = self
+        return self
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __reduce__(self):
+        return (self._make, (self._ids, self._mindigits, self._mindigits_all))
 
     def __str__(self):
         bits = []
-        for i, n in zip_longest(self, self.mindigits,
-                                fillvalue=self.mindigits_all):
+        for i, n in zip_longest(self._ids, self._mindigits,
+                                fillvalue=self._mindigits_all):
             bits.append(f'{i:0={n}}')
 
         return self.sep.join(bits)
 
+    def __repr__(self):
+        return f'{type(self).__name__}({list(self._ids)})'
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, i):
+        return self._ids[i]
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __hash__(self):
+        return hash(self._ids)
+
     def __eq__(self, other):
+        if isinstance(other, NodeID):
+            return self._ids == other._ids
         if len(self) != len(other):
             return False
         for i, j in zip(self, other):
@@ -44,50 +95,45 @@ class NodeID(list):
 
     @property
     def mindigits(self):
-        n = len(self)
-        if len(self._mindigits) > n:
-            return self._mindigits[:n]
-        else:
-            return self._mindigits
+        return list(self._mindigits)
 
-    @mindigits.setter
-    def mindigits(self, value):
+    @property
+    def mindigits_all(self):
+        return self._mindigits_all
+
+    def with_mindigits(self, value):
+        """
+        Return the same ids with a different padding,
+        either a number of digits for all ids or a list.
+        """
         if isinstance(value, int):
-            self._mindigits = []
-            self.mindigits_all = value
+            return self._make(self._ids, (), value)
         else:
-            self._mindigits = list(value)
+            return self._make(self._ids, tuple(value), self._mindigits_all)
 
     def trim(self, n):
         if n > len(self):
             return self
-        cls = type(self)
-        new = cls(self[:n])
-        new.mindigits = self.mindigits
-        new.mindigits_all = self.mindigits_all
-        return new
+        return self._make(self._ids[:n], self._mindigits, self._mindigits_all)
 
     def partition(self, n):
+        cls = type(self)
         if n > len(self):
             return self, cls([])
-        cls = type(self)
-        new1, new2 = cls(self[:n]), cls(self[n:])
-        new1.mindigits = self.mindigits
-        new1.mindigits_all = self.mindigits_all
-        new2.mindigits_all = self.mindigits_all
-        if len(self.mindigits) > n:
-            new2.mindigits = self.mindigits[n:]
+        new1 = self._make(self._ids[:n], self._mindigits, self._mindigits_all)
+        mindigits = tuple(len(str(i)) for i in self._ids[n:])
+        if len(self._mindigits) > n:
+            mindigits = self._mindigits[n:]
+        new2 = self._make(self._ids[n:], mindigits, self._mindigits_all)
         return new1, new2
 
     def last(self, n):
         if n > len(self):
             return self
-        cls = type(self)
-        new = cls(self[-n:])
-        new.mindigits_all = self.mindigits_all
-        if len(self.mindigits) > n:
-            new.mindigits = self.mindigits[n:]
-        return new
+        mindigits = tuple(len(str(i)) for i in self._ids[-n:])
+        if len(self._mindigits) > n:
+            mindigits = self._mindigits[n:]
+        return self._make(self._ids[-n:], mindigits, self._mindigits_all)
 
     @property
     def tag(self):
@@ -108,16 +154,31 @@ class NodeID(list):
         """
         Read the ids from a file path.
         Extend the indices with each subdirectory.
+        The ids of the parent directory are cached, so that only
+        the basename of the path is parsed when the parent is known.
         """
-        ids = list()
-        rest = Path(path).expanduser().absolute()
-        last = rest.name
-        while last:
-            ids_p = list(cls._ids_str_from_basename(last))
-            ids.extend(list(reversed(ids_p)))
-            rest = rest.parent
-            last = rest.name
-        return list(reversed(ids))
+        path = os.path.expanduser(os.fspath(path))
+        if not os.path.isabs(path):
+            path = os.path.join(os.getcwd(), path)
+
+        # Same normalization as Path, which keeps '..' components.
+        parts = [p for p in path.split(os.sep) if p and p != '.']
+        if not parts:
+            return []
+
+        dirpath = os.sep + os.sep.join(parts[:-1])
+        ids = list(_ids_str_from_directory(dirpath, cls.sep))
+        ids.extend(cls._ids_str_from_basename(parts[-1]))
+        return ids
+
+    @staticmethod
+    def path_cache_info():
+        """Return the hits and misses of the cache of parsed directories."""
+        return _ids_str_from_directory.cache_info()
+
+    @staticmethod
+    def clear_path_cache():
+        _ids_str_from_directory.cache_clear()
 
     @classmethod
     def from_path(cls, path=None):
@@ -170,44 +231,45 @@ class NodeID(list):
 
     from_str = read_ids
 
-    def scan_directory(self, path):
+    def iter_directory(self, path, prune=True):
         """
-        Look for matching directories and files in a path.
-        Return a list of all directories and files.
+        Walk a path and yield a NodeEntry (path, is_dir, ids)
+        for each directory and file matching these ids, as they are found.
+        The files of a directory are yielded before its subdirectories.
+        If prune is False, walk into every subdirectory,
+        not only those whose ids lead to these ids.
         """
-        directories = []
-        files = []
+        def leads_elsewhere(dirpath):
+            # Only walk into directories whose ids lead to ours.
+            return self not in self.from_path(dirpath)
 
-        # GA: Temporarily backtracking to python 3.11 compatible version.
-        #for (dirpath, dirnames, filenames) in Path(path).walk():
-        for root, dirnames, filenames in os.walk(str(path)):
-            dirpath = Path(root)
+        prune = leads_elsewhere if prune else None
+        for dirpath, dirnames, filenames in walk(path, prune=prune):
 
             for filename in filenames:
-                path = dirpath / filename
+                path = os.path.join(dirpath, filename)
                 pathID = self.from_path(path)
                 if pathID in self:
-                    files.append(str(path))
+                    yield NodeEntry(path, False, pathID)
 
-            to_remove = []
             for dirname in dirnames:
-                path = dirpath / dirname
-                #print(f'Scanning : {path}')  # DEBUG
+                path = os.path.join(dirpath, dirname)
                 pathID = self.from_path(path)
-                if (self not in pathID) and (pathID not in self):
-                    to_remove.append(dirname)
-                    continue
-
                 if pathID in self:
-                    directories.append(str(path) + '/')
-                    # Stop iteration for directories we add.
-                    if len(pathID) > len(self):
-                        to_remove.append(dirname)
-                        continue
-
-            for dirname in to_remove:
-                dirnames.remove(dirname)
+                    yield NodeEntry(path, True, pathID)
 
+    def scan_directory(self, path):
+        """
+        Look for matching directories and files in a path.
+        Return a list of all directories and files.
+        """
+        directories = []
+        files = []
+        for entry in self.iter_directory(path):
+            if entry.is_dir:
+                directories.append(entry.path + '/')
+            else:
+                files.append(entry.path)
         return directories, files
 
     @classmethod
@@ -222,3 +284,112 @@ class NodeID(list):
 
     def make_filename(self, name):
         return self.tag + name
+
+
+@lru_cache(maxsize=8192)
+def _ids_str_from_directory(dirpath: str, sep: str) -> tuple:
+    """Read the ids from a normalized absolute directory path."""
+    parent, name = os.path.split(dirpath)
+    if not name:
+        return ()
+    ids = _ids_str_from_directory(parent, sep)
+    basename = os.path.splitext(name)[0]
+    return ids + tuple(tok for tok in basename.split(sep) if tok.isdigit())
+
+
+class NodeIDTrie:
+    """
+    A prefix tree of values keyed by the integer components of NodeIDs.
+    Lookups cost a time proportional to the length of the ids.
+    """
+
+    class _Node:
+        __slots__ = ('children', 'values')
+
+        def __init__(self):
+            self.children = dict()
+            self.values = []
+
+    def __init__(self):
+        self._root = self._Node()
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return bool(self._len)
+
+    def __contains__(self, ids):
+        return bool(self.get(ids))
+
+    def clear(self):
+        self._root = self._Node()
+        self._len = 0
+
+    def _find(self, ids):
+        """Return the node of the tree at some ids, or None."""
+        node = self._root
+        for i in ids:
+            node = node.children.get(int(i))
+            if node is None:
+                return None
+        return node
+
+    def insert(self, ids, value):
+        """Store a value under some ids."""
+        node = self._root
+        for i in ids:
+            i = int(i)
+            child = node.children.get(i)
+            if child is None:
+                child = node.children[i] = self._Node()
+            node = child
+        node.values.append(value)
+        self._len += 1
+
+    def get(self, ids) -> list:
+        """Return the values stored under exactly these ids."""
+        node = self._find(ids)
+        if node is None:
+            return []
+        return list(node.values)
+
+    def items(self, ids=()):
+        """
+        Iterate over (ids, values) for these ids and all their descendants,
+        in depth-first order. The ids are tuples of integers.
+        """
+        node = self._find(ids)
+        if node is None:
+            return
+        todo = [(tuple(int(i) for i in ids), node)]
+        while todo:
+            key, node = todo.pop()
+            if node.values:
+                yield key, node.values
+            for i in reversed(node.children):
+                todo.append((key + (i,), node.children[i]))
+
+    def descendants(self, ids=()) -> list:
+        """Return the values stored under these ids or any descendant."""
+        found = []
+        for _, values in self.items(ids):
+            found.extend(values)
+        return found
+
+    def nearest_ancestor(self, ids):
+        """
+        Return the ids and values of the longest prefix of these ids
+        under which some values are stored, or ((), []) if there is none.
+        The ids themselves are considered.
+        """
+        node = self._root
+        best = (), node.values
+        for n, i in enumerate(ids, start=1):
+            node = node.children.get(int(i))
+            if node is None:
+                break
+            if node.values:
+                best = tuple(int(j) for j in ids[:n]), node.values
+        return best[0], list(best[1])
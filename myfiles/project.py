@@ -1,21 +1,28 @@
 from pathlib import Path
 import shutil
-from .config import ProjectConfig, RemoteHosts
+from .config import ProjectConfig, NodeConfig, RemoteHosts
 from .nodeid import NodeID
 from .node import Node, NodeDatabase
+from .index import ProjectIndex
 from .util import (prompt_user_and_run, run_command, prompt_user_confirmation,
-                   get_rsync_command_parts)
+                   get_rsync_command_parts, get_rsync_options, expand_wildcards)
 
 __all__ = ['Project']
 
 class Project:
 
+    # Directories where the files of a node are found.
+    locations = ProjectIndex.roots
+
     def __init__(self, config=None, path='.'):
-        config = config or ProjectConfig(path=path)
+        config = config or ProjectConfig.snapshot(path)
         self.config = config
-        self.remote = RemoteHosts()
+        self._remote = None
+        self._node_config = None
         self.name = str(config['Project']['name'])
         self.node_database = NodeDatabase()
+        self._database = None
+        self.index = ProjectIndex(self)
 
     def __str__(self):
         S = ''
@@ -72,14 +79,100 @@ class Project:
     def scratch_analysis(self):
         return self.config.scratch_analysis
 
+    @property
+    def remote(self):
+        """The remote hosts, read from the ssh configuration when needed."""
+        if self._remote is None:
+            self._remote = RemoteHosts()
+        return self._remote
+
+    @property
+    def node_config(self):
+        """The configuration shared by all the nodes of the project."""
+        if self._node_config is None:
+            self._node_config = NodeConfig.snapshot()
+        return self._node_config
+
+    @property
+    def database(self):
+        """The SQLite database of the nodes."""
+        if self._database is None:
+            from .database import NodeSQLiteDatabase
+            self._database = NodeSQLiteDatabase(
+                self.config.node_sqlite_fname,
+                config=self.node_config, project=self)
+        return self._database
+
     def write_database(self):
-        # Overwrite existing database
-        fname = str(self.config.node_database_fname)
-        self.node_database.write(fname)
+        # Only the rows of the nodes that changed are written.
+        self.database.write(self.node_database, remove_others=True)
+        self.index.write(self.config.node_index_fname)
+
+    def read_database(self, **kwargs):
+        """
+        Read the nodes from the database.
+        Keyword arguments select the nodes, see NodeSQLiteDatabase.query.
+        The index is read only if the nodes need it.
+        """
+        if self.config.node_sqlite_fname.exists():
+            self.node_database = self.database.query(**kwargs)
+        self.index.read_later(self.config.node_index_fname)
+
+    def read_index(self):
+        if self.config.node_index_fname.exists():
+            self.index.read(self.config.node_index_fname)
+
+    def export_database(self, fname=None):
+        """Write the nodes in the JSON list format."""
+        fname = fname or self.config.node_database_fname
+        self.node_database.write(str(fname))
+
+    def update_database(self, threads=None):
+        """
+        Scan the project for nodes and write the database.
+        Only the directories modified since the last update are listed again.
+        """
+        self.read_index()
+        self.index.refresh(threads=threads)
+        self.node_database.clear()
+        self.node_database.extend(self.find_nodes())
+        self.write_database()
 
-    def read_database(self):
-        if self.config.node_database_fname.exists():
-            self.node_database.read(str(self.config.node_database_fname))
+    def find_nodes(self):
+        """
+        Return a list of nodes found in the project index,
+        from the directories of production and analysis
+        and the files of results.
+        """
+        return list(self.iter_nodes())
+
+    def iter_nodes(self, threads=None):
+        """
+        Yield the nodes found in the project index, already scanned.
+        All the nodes share the project and its configuration,
+        and the root directories are walked only once.
+        """
+        if threads:
+            self.index.scan_missing(threads=threads)
+        config = self.node_config
+        nodes = dict()
+        for where in self.index.roots:
+            for path, is_dir in self.index[where].iter_top_level():
+                if where != 'results' and not is_dir:
+                    continue
+                ids = NodeID.from_path(path)
+                if not ids:
+                    continue
+                if ids not in nodes:
+                    nodes[ids] = Node(ids, config=config, project=self)
+                node = nodes[ids]
+                if is_dir and node._name == config['Node']['name']:
+                    node.name = ids.strip_ids(path)
+
+        for node in nodes.values():
+            node.scan()
+            node.find_status()
+            yield node
 
     def iter_dir_nodes(self, directory):
         """
@@ -89,7 +182,8 @@ class Project:
         for dirname in path.iterdir():
             if not dirname.is_dir():
                 continue
-            node = Node.from_path(dirname, project=self)
+            node = Node.from_path(dirname, config=self.node_config,
+                                  project=self)
             if not node:
                 continue
             yield node
@@ -103,7 +197,8 @@ class Project:
     def iter_results_nodes(self):
         path = Path(self.results)
         for fname in path.iterdir():
-            node = Node.from_path(fname)
+            node = Node.from_path(fname, config=self.node_config,
+                                  project=self)
             if not node:
                 continue
             yield node
@@ -125,67 +220,231 @@ class Project:
         for d in todo:
             d.mkdir(exist_ok=True)
 
-    def pull_production_dir(self, hostname, ids, **kwargs):
-        if hostname not in self.remote:
-            raise Exception(f'Unknown host: {hostname}')
+    # Kinds of transfer of the production directory of a node.
+    transfer_kinds = ('pull_remote', 'push_remote',
+                      'pull_scratch', 'push_scratch')
 
-        node = Node(ids)
-        tag = node.ids.tag
-        rel_prod = self.production.relative_to(self.config.home)
-        loc_prod = self.production.relative_to(Path().absolute())
-        source = f"{hostname}:{rel_prod}/{tag}*"
-        dest = f"{loc_prod}/"
-        command_parts = get_rsync_command_parts(source, dest, **kwargs)
-        return prompt_user_and_run(command_parts)
+    def get_transfer_paths(self, kind, ids, hostname=None):
+        """
+        Return the source and destination of a transfer of
+        the production directories of a node.
+        The source contains a wildcard matching all directories of the node.
+        """
+        ids = NodeID(ids)
+        if kind.startswith('push') and not ids:
+            raise Exception(f'Node not found: {ids}')
 
-    def push_production_dir(self, hostname, ids, **kwargs):
+        tag = ids.tag
+        if kind.endswith('remote'):
+            if hostname not in self.remote:
+                raise Exception(f'Unknown host: {hostname}')
+            rel_prod = self.production.relative_to(self.config.home)
+            loc_prod = self.production.relative_to(Path().absolute())
+            if kind == 'pull_remote':
+                source = f"{hostname}:{rel_prod}/{tag}*"
+                dest = f"{loc_prod}/"
+            else:
+                source = f"{loc_prod}/{tag}*"
+                dest = f"{hostname}:{rel_prod}/"
+
+        elif kind.endswith('scratch'):
+            scratchdir = (self.scratch
+                          / self.production.relative_to(self.topdir))
+            if kind == 'pull_scratch':
+                sourcedir, destdir = scratchdir, self.production
+            else:
+                sourcedir, destdir = self.production, scratchdir
+            source = f"{sourcedir}/{tag}*"
+            dest = f"{destdir}/"
 
-        if hostname not in self.remote:
-            raise Exception(f'Unknown host: {hostname}')
+        else:
+            raise Exception(f'Unknown kind of transfer: {kind}')
 
-        node = Node(ids)
-        if not node:
-            raise Exception(f'Node not found: {ids}')
+        return source, dest
 
-        tag = node.ids.tag
-        rel_prod = self.production.relative_to(self.config.home)
-        loc_prod = self.production.relative_to(Path().absolute())
-        source = f"{loc_prod}/{tag}*"
-        dest = f"{hostname}:{rel_prod}/"
+    def pull_production_dir(self, hostname, ids, **kwargs):
+        kwargs.setdefault('rsh', self.remote.get_rsh(hostname))
+        source, dest = self.get_transfer_paths('pull_remote', ids, hostname)
+        command_parts = get_rsync_command_parts(source, dest, **kwargs)
+        return prompt_user_and_run(command_parts)
+
+    def push_production_dir(self, hostname, ids, **kwargs):
+        kwargs.setdefault('rsh', self.remote.get_rsh(hostname))
+        source, dest = self.get_transfer_paths('push_remote', ids, hostname)
         command_parts = get_rsync_command_parts(source, dest, **kwargs)
         return prompt_user_and_run(command_parts)
 
     def pull_scratch(self, ids, **kwargs):
-        node = Node(ids)
-        tag = str(node.ids.tag)
-        sourcedir = self.scratch / self.production.relative_to(self.topdir)
-        destdir = self.production
-        source = f"{sourcedir}/{tag}*"
-        dest = f"{destdir}/"
+        source, dest = self.get_transfer_paths('pull_scratch', ids)
         command_parts = get_rsync_command_parts(source, dest, **kwargs)
         return prompt_user_and_run(command_parts)
 
     def push_scratch(self, ids, **kwargs):
-        node = Node(ids)
-        if not node:
-            raise Exception(f'Node not found: {ids}')
-
-        tag = str(node.ids.tag)
-        sourcedir = self.production
-        destdir = self.scratch / self.production.relative_to(self.topdir)
-        source = f"{sourcedir}/{tag}*"
-        dest = f"{destdir}/"
+        source, dest = self.get_transfer_paths('push_scratch', ids)
         command_parts = get_rsync_command_parts(source, dest, **kwargs)
         return prompt_user_and_run(command_parts)
 
-    def copy_analysis_files_to_results(self, *args, **kwargs):
+    def find_node_ids(self, prefix=(), where='production'):
+        """
+        Return the ids of the nodes under a prefix, from the directories
+        found at the top of a root directory of the project.
+        """
+        if isinstance(prefix, str):
+            prefix = NodeID.from_str(prefix)
+        else:
+            prefix = NodeID(prefix)
+
+        found = dict()
+        for path, is_dir in self.index[where].iter_top_level():
+            if not is_dir:
+                continue
+            ids = NodeID.from_path(path)
+            if ids and ids in prefix:
+                found[ids] = None
+        return list(found)
+
+    def scan_remote(self, hostname, where='production'):
+        """
+        List a root directory of the project on a remote host,
+        with a single command over the shared ssh connection.
+        Return the RemoteRootIndex.
+        """
+        from .index import RemoteRootIndex
+        if hostname not in self.remote:
+            raise Exception(f'Unknown host: {hostname}')
+        root = getattr(self, where)
+        index = RemoteRootIndex(root, hostname,
+                                root.relative_to(self.config.home),
+                                self.remote.get_ssh_options(hostname))
+        return index.scan()
+
+    def diff_remote(self, hostname, prefix=(), where='production'):
+        """
+        Compare the nodes of a root directory under a prefix,
+        locally and on a remote host, listed with a single remote command.
+        Return the IndexDiff.
+        """
+        from .index import IndexDiff
+        if isinstance(prefix, str):
+            prefix = NodeID.from_str(prefix)
+        remote = self.scan_remote(hostname, where)
+        return IndexDiff(self.index[where], remote, prefix)
+
+    def _get_ids_list(self, ids_list=None, prefix=None):
+        """The ids of a list, and those of the nodes found under a prefix."""
+        ids_list = [NodeID.from_str(i) if isinstance(i, str) else NodeID(i)
+                    for i in (ids_list or [])]
+        if prefix is not None:
+            for ids in self.find_node_ids(prefix):
+                if ids not in ids_list:
+                    ids_list.append(ids)
+        return ids_list
+
+    def plan_transfer(self, kind, ids_list=None, prefix=None, hostname=None,
+                      verbose=False, **kwargs):
+        """
+        Find the changes that a transfer of many nodes would make,
+        with a single dry run of rsync for all of them.
+        Arguments are those of transfer_batch.
+
+        Returns
+        -------
+        The TransferPlan, with the files and bytes to transfer for each node.
+        """
+        from .transfer import TransferPlan
+        ids_list = self._get_ids_list(ids_list, prefix)
+        plan = TransferPlan(ids_list)
+
+        sources = []
+        dest = None
+        for ids in ids_list:
+            source, dest = self.get_transfer_paths(kind, ids, hostname)
+            sources.extend(expand_wildcards(source))
+
+        kwargs['dry_run'] = False
+        options = get_rsync_options(**kwargs)
+        return plan.run(sources, dest, options, verbose=verbose)
+
+    def transfer_batch(self, kind, ids_list=None, prefix=None, hostname=None,
+                       jobs=4, prompt=True, verbose=False, plan=False,
+                       **kwargs):
+        """
+        Transfer the production directories of many nodes,
+        running up to `jobs` rsync commands concurrently
+        after a single confirmation.
+
+        Arguments
+        ---------
+        kind: One of Project.transfer_kinds.
+        ids_list: A list of node ids.
+        prefix: Transfer all the nodes found locally under these ids.
+        hostname: The remote host, for remote transfers.
+        plan: First find the changes with a single dry run,
+              and only transfer the nodes that have changes.
+
+        Remote transfers share a single ssh connection,
+        opened before the first one and closed after the last one.
+
+        Returns
+        -------
+        The TransferBatch, with the exit status of every transfer.
+        """
+        if kind.endswith('remote') and hostname in self.remote:
+            kwargs.setdefault('rsh', self.remote.get_rsh(hostname))
+            with self.remote.connection(hostname):
+                return self._transfer_batch(
+                    kind, ids_list, prefix, hostname, jobs, prompt,
+                    verbose, plan, **kwargs)
+        return self._transfer_batch(kind, ids_list, prefix, hostname, jobs,
+                                    prompt, verbose, plan, **kwargs)
+
+    def _transfer_batch(self, kind, ids_list, prefix, hostname, jobs,
+                        prompt, verbose, plan, **kwargs):
+        ids_list = self._get_ids_list(ids_list, prefix)
+
+        if plan:
+            transfer_plan = self.plan_transfer(kind, ids_list,
+                                               hostname=hostname,
+                                               verbose=verbose, **kwargs)
+            print(transfer_plan.get_report())
+            # If the dry run failed, every node is transferred.
+            if transfer_plan.success:
+                ids_list = transfer_plan.changed_ids
+
+        from .transfer import TransferBatch
+        batch = TransferBatch(jobs=jobs, verbose=verbose)
+        for ids in ids_list:
+            source, dest = self.get_transfer_paths(kind, ids, hostname)
+            command_parts = get_rsync_command_parts(source, dest, **kwargs)
+            batch.add(ids, command_parts,
+                      nsources=len(expand_wildcards(source)))
+
+        batch.run(prompt=prompt)
+        print(batch.get_report())
+        return batch
+
+    def copy_analysis_files_to_results(self, exclude=('.py',), verbose=True,
+                                       threads=None, mode='auto'):
         """
         Look for files produced in analysis directory and copy them to
         the results directory.
+        With a number of threads, the files of all nodes are copied
+        concurrently. See manifest.copy_file for the modes of copy.
+        Return the number of files copied.
         """
-        for node in self.iter_analysis_nodes():
-            node.scan_analysis()
-            node.copy_analysis_files_to_results(*args, **kwargs)
+        from .manifest import CopyManifest
+        manifest = CopyManifest(self.config.results_manifest_fname)
+        pairs = (pair for node in self.iter_analysis_nodes()
+                 for pair in node.iter_results_copies(exclude))
+        # The files copied are recorded even if a copy fails.
+        try:
+            ncopied = manifest.copy_files(pairs, threads=threads,
+                                          verbose=verbose, mode=mode)
+        finally:
+            manifest.write()
+        if verbose:
+            print(manifest.get_report())
+        return ncopied
 
     def push_local_data(self, hostname, **kwargs):
         if hostname not in self.remote:
@@ -195,6 +454,7 @@ class Project:
         destdir = self.local_data.relative_to(self.config.home)
         source = f"{sourcedir}/"
         dest = f"{hostname}:{destdir}"
+        kwargs.setdefault('rsh', self.remote.get_rsh(hostname))
         command_parts = get_rsync_command_parts(source, dest, **kwargs)
         return prompt_user_and_run(command_parts)
 
@@ -206,6 +466,7 @@ class Project:
         destdir = self.global_data.relative_to(self.config.home)
         source = f"{sourcedir}/"
         dest = f"{hostname}:{destdir}"
+        kwargs.setdefault('rsh', self.remote.get_rsh(hostname))
         command_parts = get_rsync_command_parts(source, dest, **kwargs)
         return prompt_user_and_run(command_parts)
 
@@ -0,0 +1,201 @@
+"""
+Catalog of the pseudopotential files of a data directory.
+
+The pseudopotential directory is walked once, and the search
+of pseudopotential files by keywords and by element
+is then answered from memory.
+"""
+import os
+import json
+
+from .index import RootIndex
+from .util import list_directory
+
+__all__ = ['PseudoCatalog', 'get_catalog']
+
+
+class PseudoCatalog(RootIndex):
+    """
+    All the subdirectories of a pseudopotential directory,
+    and the files of each element that they contain.
+
+    A refresh only lists again the directories that have changed,
+    and keeps the directories matching some keywords
+    if no directory was added or removed.
+    """
+
+    def __init__(self, root, fname=None):
+        super().__init__(root)
+
+        # File where the catalog is kept between processes.
+        self.fname = fname
+
+        # Subdirectories, in the order of a top-down walk.
+        self._directories = []
+
+        # Directories matching some keywords, by keywords.
+        self._matches = dict()
+
+        # Map of the elements of a directory, by path.
+        self._elements = dict()
+
+    def __str__(self):
+        return f'PseudoCatalog({self.root})'
+
+    def __len__(self):
+        return len(self._directories)
+
+    def clear(self):
+        super().clear()
+        self._directories = []
+        self._matches = dict()
+
+    def scan(self, refresh=False, executor=None):
+        """
+        Walk the pseudopotential directory, without following symlinks,
+        and write the catalog file if some directories were listed.
+        """
+        super().scan(refresh=refresh, executor=executor)
+        if self.fname is not None and self.nlisted:
+            try:
+                os.makedirs(os.path.dirname(self.fname), exist_ok=True)
+                self.write(self.fname)
+            except OSError:
+                pass
+        return self
+
+    def _make_entries(self):
+        """List the subdirectories in the order of a top-down walk."""
+        directories = []
+        todo = ['.']
+        while todo:
+            rel = todo.pop()
+            listing = self.dirs.get(rel)
+            if listing is None:
+                continue
+            for dirname in listing[1]:
+                directories.append(self._abspath(self._relpath(rel, dirname)))
+            todo.extend(reversed(self._subdirs(rel, listing)))
+
+        if directories != self._directories:
+            self._directories = directories
+            self._matches = dict()
+        self.scanned = True
+
+    @property
+    def directories(self):
+        """All the subdirectories, in the order of a top-down walk."""
+        if not self.scanned:
+            self.scan()
+        return list(self._directories)
+
+    def match(self, keywords):
+        """
+        Return the subdirectories whose name contain
+        the largest number of keywords.
+        If none contains all the keywords, the directories that changed
+        are listed again before answering.
+        """
+        if not self.scanned:
+            self.scan()
+        keywords = tuple(keywords)
+        if keywords not in self._matches:
+            nmax, matching = self._match(keywords)
+            if nmax < len(keywords):
+                self.refresh()
+                nmax, matching = self._match(keywords)
+            self._matches[keywords] = matching
+        return list(self._matches[keywords])
+
+    def _match(self, keywords):
+        """The largest number of keywords found, and the directories."""
+        counts = []
+        for path in self._directories:
+            dirname = os.path.basename(path).lower()
+            counts.append(sum(1 for kw in keywords if kw.lower() in dirname))
+        if not counts:
+            return 0, []
+        nmax = max(counts)
+        return nmax, [path for path, n in zip(self._directories, counts)
+                      if n == nmax]
+
+    def elements(self, path) -> dict:
+        """
+        Map each element to the first file of a directory whose name
+        starts with the element followed by a dot.
+        The directory is listed again only if it was modified.
+        """
+        path = os.path.abspath(os.fspath(path))
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return dict()
+
+        cached = self._elements.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        rel = os.path.relpath(path, str(self.root))
+        listing = self.dirs.get(rel)
+        if listing is None or listing[0] != mtime:
+            try:
+                listing = [mtime, *list_directory(path)]
+            except OSError:
+                return dict()
+            if rel in self.dirs:
+                self.dirs[rel] = listing
+
+        elements = dict()
+        for name in listing[2]:
+            i = name.find('.')
+            while i > 0:
+                elements.setdefault(name[:i], name)
+                i = name.find('.', i + 1)
+
+        self._elements[path] = (listing[0], elements)
+        return elements
+
+    def write(self, fname):
+        tmpname = str(fname) + '.tmp'
+        with open(tmpname, 'w') as fn:
+            json.dump(self.to_dict(), fn)
+        os.replace(tmpname, str(fname))
+
+    @classmethod
+    def read(cls, fname):
+        with open(str(fname), 'r') as fn:
+            return cls.from_dict(json.load(fn))
+
+
+# Catalogs in use, by root directory.
+_catalogs = dict()
+
+
+def get_catalog(root, fname=None, scan=True) -> PseudoCatalog:
+    """
+    Return the catalog of a pseudopotential directory, kept for the process.
+
+    The catalog is first read from a file, if any, and refreshed.
+    It is refreshed again when a search misses, see PseudoCatalog.match
+    and DataDir.get_pseudopotential_sets.
+    If scan is False, the catalog may not be walked yet,
+    which is enough to read the elements of a directory.
+    """
+    root = os.path.abspath(os.path.expanduser(os.fspath(root)))
+    catalog = _catalogs.get(root)
+    if catalog is None:
+        catalog = _catalogs[root] = PseudoCatalog(root, fname)
+    if catalog.fname is None:
+        catalog.fname = fname
+    if not scan or catalog.scanned:
+        return catalog
+
+    if fname is not None and os.path.exists(fname):
+        try:
+            stored = PseudoCatalog.read(fname)
+        except (OSError, ValueError, KeyError):
+            stored = None
+        if stored is not None and str(stored.root) == root:
+            catalog.dirs = stored.dirs
+
+    return catalog.refresh()
@@ -0,0 +1,168 @@
+"""
+Reader of the ssh client configuration file (~/.ssh/config).
+"""
+import os
+import re
+import glob
+import shlex
+from fnmatch import fnmatch
+
+__all__ = ['SSHConfig', 'read_ssh_config']
+
+
+class SSHConfig:
+    """
+    The Host blocks of an ssh configuration file and of the files
+    it includes, with their patterns and settings.
+
+    As with ssh, the first value obtained for a setting wins,
+    and keywords are case insensitive.
+    Match blocks are read, but never considered to match.
+    """
+
+    # Maximum depth of nested Include directives, as in ssh.
+    max_depth = 16
+
+    _line = re.compile(r'^(\w+)(?:\s*=\s*|\s+)(.*)$')
+
+    def __init__(self, fname='~/.ssh/config'):
+        self.fname = os.path.expanduser(str(fname))
+
+        # Blocks of (patterns, settings); patterns None for Match blocks.
+        self.blocks = [(['*'], dict())]
+
+        # Files and directories read, whose changes invalidate the reading.
+        self.files_read = []
+        self.dirs_read = []
+
+    def read(self):
+        self._read_file(self.fname, self.blocks[0], 0)
+        return self
+
+    def _read_file(self, fname, block, depth):
+        """Read a file, whose first lines belong to a block."""
+        try:
+            with open(fname, 'r') as fn:
+                lines = fn.readlines()
+        except OSError:
+            return
+        self.files_read.append(fname)
+
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            match = self._line.match(line)
+            if not match:
+                continue
+            keyword, rest = match.groups()
+            keyword = keyword.lower()
+            try:
+                arguments = shlex.split(rest)
+            except ValueError:
+                arguments = rest.split()
+
+            if keyword == 'host':
+                block = (arguments, dict())
+                self.blocks.append(block)
+            elif keyword == 'match':
+                block = (None, dict())
+                self.blocks.append(block)
+            elif keyword == 'include':
+                if depth < self.max_depth:
+                    for pattern in arguments:
+                        self._include(pattern, block, depth)
+            elif arguments:
+                block[1].setdefault(keyword, ' '.join(arguments))
+
+    def _include(self, pattern, block, depth):
+        """Read the files of an Include directive within a block."""
+        pattern = os.path.expanduser(pattern)
+        if not os.path.isabs(pattern):
+            pattern = os.path.join(os.path.dirname(self.fname), pattern)
+        dirname = os.path.dirname(pattern)
+        if dirname not in self.dirs_read:
+            self.dirs_read.append(dirname)
+
+        # Blocks opened by the included files end with them.
+        for fname in sorted(glob.glob(pattern)):
+            self._read_file(fname, block, depth + 1)
+
+    @staticmethod
+    def matches(patterns, hostname):
+        """True if a hostname matches some Host patterns."""
+        if patterns is None:
+            return False
+        found = False
+        for pattern in patterns:
+            if pattern.startswith('!'):
+                if fnmatch(hostname, pattern[1:]):
+                    return False
+            elif fnmatch(hostname, pattern):
+                found = True
+        return found
+
+    @property
+    def hosts(self):
+        """The host aliases, without wildcards, in order of appearance."""
+        hosts = []
+        for patterns, _ in self.blocks[1:]:
+            for pattern in patterns or []:
+                if (pattern.startswith('!')
+                        or any(c in pattern for c in '*?')):
+                    continue
+                if pattern not in hosts:
+                    hosts.append(pattern)
+        return hosts
+
+    def __contains__(self, hostname):
+        """True if a Host block, other than 'Host *', names a hostname."""
+        for patterns, _ in self.blocks[1:]:
+            if patterns and patterns != ['*'] and self.matches(patterns,
+                                                              hostname):
+                return True
+        return False
+
+    def lookup(self, hostname) -> dict:
+        """Return the settings of a host, with lower case keywords."""
+        settings = dict()
+        for patterns, block in self.blocks:
+            if self.matches(patterns, hostname):
+                for keyword, value in block.items():
+                    settings.setdefault(keyword, value)
+        settings.setdefault('hostname', hostname)
+        return settings
+
+    def get_state(self):
+        """The modification times of the files and directories read."""
+        state = []
+        names = [self.fname] + self.files_read + self.dirs_read
+        for fname in dict.fromkeys(names):
+            try:
+                stat = os.stat(fname)
+            except OSError:
+                state.append((fname, None))
+                continue
+            state.append((fname, stat.st_mtime_ns, stat.st_size))
+        return state
+
+
+# Configurations read, by file name, with their state when read.
+_ssh_configs = dict()
+
+
+def read_ssh_config(fname='~/.ssh/config') -> SSHConfig:
+    """
+    Return the ssh configuration, read again only if one of its files
+    changed, or if files were added in a directory that it includes.
+    """
+    fname = os.path.expanduser(str(fname))
+    cached = _ssh_configs.get(fname)
+    if cached is not None:
+        config, state = cached
+        if config.get_state() == state:
+            return config
+
+    config = SSHConfig(fname).read()
+    _ssh_configs[fname] = (config, config.get_state())
+    return config
@@ -0,0 +1,267 @@
+"""
+Concurrent rsync transfers for batches of nodes.
+"""
+import asyncio
+import re
+import time
+
+from .nodeid import NodeID, NodeIDTrie
+from .util import CommandResult, prompt_user_confirmation, run_command
+
+__all__ = ['Transfer', 'TransferBatch', 'NodeDelta', 'TransferPlan']
+
+_units = {'': 1, 'K': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12}
+
+
+def parse_size(number, unit=''):
+    """Read a number of bytes printed by rsync, e.g. 1,234 or 1.23K."""
+    return int(float(number.replace(',', '')) * _units[unit])
+
+
+class Transfer(CommandResult):
+    """An rsync command transferring the files of a node."""
+
+    # Summary line printed by rsync in verbose mode.
+    _summary = re.compile(
+        r'sent\s+([\d.,]+)([KMGT]?)\s+bytes\s+'
+        r'received\s+([\d.,]+)([KMGT]?)\s+bytes')
+
+    def __init__(self, ids, command_parts, nsources=1):
+        super().__init__(command_parts)
+        self.ids = ids
+        self.nsources = nsources
+        self.nbytes = 0
+
+    @property
+    def skipped(self):
+        """True if there was nothing to transfer."""
+        return not self.nsources
+
+    @property
+    def status(self):
+        if self.skipped:
+            return 'nothing to transfer'
+        if self.returncode is None:
+            return 'not run'
+        if self.success:
+            return 'ok'
+        return f'failed (exit status {self.returncode})'
+
+    def read_nbytes(self):
+        """Read the number of bytes sent and received from rsync output."""
+        self.nbytes = 0
+        match = self._summary.search(self.stdout)
+        if match:
+            sent, sent_unit, received, received_unit = match.groups()
+            self.nbytes = (parse_size(sent, sent_unit)
+                           + parse_size(received, received_unit))
+        return self.nbytes
+
+
+class TransferBatch(list):
+    """
+    A list of transfers, executed concurrently
+    with at most `jobs` rsync processes at a time.
+    """
+
+    def __init__(self, jobs=4, verbose=False):
+        super().__init__()
+        self.jobs = max(1, int(jobs))
+        self.verbose = verbose
+        self.elapsed = 0.
+
+    def add(self, ids, command_parts, **kwargs):
+        transfer = Transfer(ids, command_parts, **kwargs)
+        self.append(transfer)
+        return transfer
+
+    async def _run_one(self, transfer, semaphore):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *transfer.command_parts,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE)
+                stdout, stderr = await process.communicate()
+            except OSError as error:
+                # Same exit status as a shell for a missing command.
+                transfer.returncode = 127
+                transfer.stderr = str(error) + '\n'
+            else:
+                transfer.returncode = process.returncode
+                transfer.stdout = stdout.decode(errors='replace')
+                transfer.stderr = stderr.decode(errors='replace')
+                transfer.read_nbytes()
+            transfer.elapsed = time.perf_counter() - start
+
+        if self.verbose:
+            print(f'--- {transfer.ids}: {transfer.status}')
+            print(transfer.stdout + transfer.stderr, end='')
+
+    async def _run_all(self):
+        semaphore = asyncio.Semaphore(self.jobs)
+        await asyncio.gather(*[self._run_one(transfer, semaphore)
+                               for transfer in self if not transfer.skipped])
+
+    def run(self, prompt=True):
+        """Run all the transfers, after asking for confirmation."""
+        todo = [transfer for transfer in self if not transfer.skipped]
+        if not todo:
+            return self
+
+        if prompt:
+            message = (f'Will execute the following {len(todo)} commands, '
+                       f'{self.jobs} at a time:\n')
+            message += '\n'.join(transfer.command for transfer in todo)
+            if not prompt_user_confirmation(message):
+                return self
+
+        start = time.perf_counter()
+        asyncio.run(self._run_all())
+        self.elapsed = time.perf_counter() - start
+        return self
+
+    @property
+    def nbytes(self):
+        return sum(transfer.nbytes for transfer in self)
+
+    @property
+    def success(self):
+        return all(transfer.success or transfer.skipped for transfer in self)
+
+    def get_report(self):
+        S = ''
+        for transfer in self:
+            S += f'{str(transfer.ids):>12}  {transfer.status}'
+            if transfer.returncode is not None:
+                S += f'  {transfer.nbytes} bytes in {transfer.elapsed:.1f} s'
+            S += '\n'
+
+        nfailed = sum(1 for transfer in self
+                      if transfer.returncode not in (None, 0))
+        S += f'{len(self)} nodes, {nfailed} failed, '
+        S += f'{self.nbytes} bytes in {self.elapsed:.1f} s'
+        if self.elapsed > 0:
+            S += f' ({self.nbytes / self.elapsed / 1e6:.2f} MB/s)'
+        return S
+
+
+class NodeDelta:
+    """The changes that a transfer would make to the files of a node."""
+
+    def __init__(self, ids):
+        self.ids = ids
+
+        # Itemized changes, as (changes, size, path).
+        self.items = []
+        self.nfiles = 0
+        self.nbytes = 0
+
+    @property
+    def changed(self):
+        return bool(self.items)
+
+    def add(self, changes, size, path):
+        self.items.append((changes, size, path))
+        # Files sent or received, as opposed to
+        # created directories or changed attributes.
+        if changes[0] in '<>' and changes[1] == 'f':
+            self.nfiles += 1
+            self.nbytes += size
+
+
+class TransferPlan(dict):
+    """
+    The changes that the transfers of many nodes would make,
+    by node ids, found with a single dry run of rsync.
+    """
+
+    # Options of the dry run, to list each change with the size of the file.
+    options = ['--dry-run', '--itemize-changes', '--stats',
+               '--out-format=%i %l %n']
+
+    _item = re.compile(r'^([<>ch.*][fdLDS]\S*|\*deleting)'
+                       r'\s+([\d.,]+)([KMGT]?)\s+(.+)$')
+
+    def __init__(self, ids_list):
+        super().__init__()
+
+        # The ids of the plan, to find the node of a path by prefix.
+        self._trie = NodeIDTrie()
+        for ids in ids_list:
+            ids = NodeID(ids)
+            if ids not in self:
+                self._trie.insert(ids, ids)
+            self[ids] = NodeDelta(ids)
+        self.result = None
+        self.unmatched = []
+
+    def run(self, sources, dest, options, verbose=False):
+        """Run rsync once for all sources, and read the changes."""
+        if not sources:
+            return self
+        command_parts = ['rsync'] + sources + [dest] + options + self.options
+        self.result = run_command(command_parts, echo=verbose)
+        self.read(self.result.stdout)
+        return self
+
+    def find_ids(self, path):
+        """
+        Return the ids of the node that a path belongs to:
+        the longest ids of the plan that start the ids of its top directory.
+        """
+        if path.startswith('./'):
+            path = path[2:]
+        top = path.split('/')[0]
+        _, found = self._trie.nearest_ancestor(NodeID.from_str(top))
+        return found[0] if found else None
+
+    def read(self, stdout):
+        for line in stdout.splitlines():
+            match = self._item.match(line)
+            if not match:
+                continue
+            changes, size, unit, path = match.groups()
+            ids = self.find_ids(path)
+            if ids is None:
+                self.unmatched.append(path)
+                continue
+            self[ids].add(changes, parse_size(size, unit), path)
+
+    @property
+    def success(self):
+        return self.result is None or self.result.success
+
+    @property
+    def changed_ids(self):
+        """The ids of the nodes with changes to transfer."""
+        return [ids for ids, delta in self.items() if delta.changed]
+
+    @property
+    def nfiles(self):
+        return sum(delta.nfiles for delta in self.values())
+
+    @property
+    def nbytes(self):
+        return sum(delta.nbytes for delta in self.values())
+
+    def get_report(self):
+        # Without a dry run, the changes of the nodes are unknown.
+        if not self.success:
+            S = (f'Dry run failed (exit status {self.result.returncode}):\n'
+                 + self.result.stderr)
+            S += f'Changes unknown, {len(self)} nodes to transfer'
+            return S
+
+        S = ''
+        for ids, delta in self.items():
+            S += f'{str(ids):>12}  '
+            if delta.changed:
+                S += f'{delta.nfiles} files, {delta.nbytes} bytes'
+            else:
+                S += 'up to date'
+            S += '\n'
+        S += f'{len(self.changed_ids)} of {len(self)} nodes to transfer, '
+        S += f'{self.nfiles} files, {self.nbytes} bytes'
+        return S
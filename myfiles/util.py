@@ -1,5 +1,7 @@
 import os
-import subprocess
+import sys
+import glob
+import time
 
 from enum import Enum, auto
 class ScanResult(Enum):
@@ -10,38 +12,168 @@ class ScanResult(Enum):
         #no_files = auto()
         #no_directories = auto()
 
-def run_command(command_parts):
-    command = ' '.join(command_parts)
-    return os.system(command)
+def list_directory(path):
+    """
+    Return the names of the subdirectories, the files, and the
+    subdirectories that are symlinks in a directory,
+    using the file types cached by os.scandir.
+    """
+    dirnames, filenames, links = [], [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if not is_dir:
+                filenames.append(entry.name)
+                continue
+            dirnames.append(entry.name)
+            if entry.is_symlink():
+                links.append(entry.name)
+    return dirnames, filenames, links
+
+def walk(top, prune=None):
+    """
+    Walk a directory tree top-down, as os.walk without following symlinks,
+    and yield (dirpath, dirnames, filenames) as strings.
+    Subdirectories removed from dirnames, or whose path
+    satisfies prune(path), are not walked into.
+    """
+    todo = [os.fspath(top)]
+    while todo:
+        dirpath = todo.pop()
+        try:
+            dirnames, filenames, links = list_directory(dirpath)
+        except OSError:
+            continue
+
+        yield dirpath, dirnames, filenames
+
+        links = set(links)
+        subdirs = []
+        for dirname in dirnames:
+            if dirname in links:
+                continue
+            path = os.path.join(dirpath, dirname)
+            if prune is not None and prune(path):
+                continue
+            subdirs.append(path)
+        todo.extend(reversed(subdirs))
+
+class CommandResult:
+    """The exit status, output and wall-clock time of a command."""
+
+    def __init__(self, command_parts, returncode=None, stdout='', stderr='',
+                 elapsed=0.):
+        self.command_parts = [str(part) for part in command_parts]
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.elapsed = elapsed
+
+    def __str__(self):
+        return self.command
+
+    @property
+    def command(self):
+        return ' '.join(self.command_parts)
+
+    @property
+    def success(self):
+        return self.returncode == 0
+
+def run_command(command_parts, capture=True, echo=True, cwd=None):
+    """
+    Execute a command given as a list of arguments, without a shell.
+    The output is printed as it comes if echo is True,
+    and kept in the result if capture is True.
+    Return a CommandResult.
+    """
+    import subprocess
+    import threading
+
+    result = CommandResult(command_parts)
+    pipe = subprocess.PIPE if (capture or not echo) else None
+    start = time.perf_counter()
+    try:
+        process = subprocess.Popen(result.command_parts, cwd=cwd,
+                                   stdout=pipe, stderr=pipe,
+                                   text=True, errors='replace', bufsize=1)
+    except OSError as error:
+        # Same exit status as a shell for a missing command.
+        result.returncode = 127
+        result.stderr = f'{error}\n'
+        if echo:
+            sys.stderr.write(result.stderr)
+        return result
+
+    if pipe is None:
+        result.returncode = process.wait()
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    def read(stream, lines, out):
+        for line in stream:
+            if capture:
+                lines.append(line)
+            if echo:
+                out.write(line)
+                out.flush()
+
+    # Read stderr in a thread so that neither pipe can fill up.
+    stdout, stderr = [], []
+    thread = threading.Thread(target=read,
+                              args=(process.stderr, stderr, sys.stderr))
+    thread.start()
+    read(process.stdout, stdout, sys.stdout)
+    thread.join()
+
+    result.returncode = process.wait()
+    result.elapsed = time.perf_counter() - start
+    result.stdout = ''.join(stdout)
+    result.stderr = ''.join(stderr)
+    return result
+
+# When True, every confirmation is answered yes, for non-interactive use.
+assume_yes = False
+
+def set_assume_yes(value=True):
+    global assume_yes
+    assume_yes = value
 
 def prompt_user_confirmation(message):
     print(message)
-    answer = input('Do you want to proceed? [y/N]: ')
+    if assume_yes:
+        return True
+    try:
+        answer = input('Do you want to proceed? [y/N]: ')
+    except EOFError:
+        return False
     if answer.lower().startswith('y'):
         return True
     return False
 
-def prompt_user_and_run(command_parts):
-
-    command = ' '.join(command_parts)
+def prompt_user_and_run(command_parts, **kwargs):
+    """
+    Ask for confirmation and execute a command.
+    Return a CommandResult, or None if the command was not executed.
+    """
+    command = ' '.join(str(part) for part in command_parts)
     message = 'Will execute the following command:\n' + command
     if prompt_user_confirmation(message):
-        result = os.system(command)
-
-        # GA: This one doesnt work! Why??
-        #result = subprocess.run(command_parts)
-
-            #capture_output=True,text=True)
-            # Check the return code
-            #print("Return Code:", result.returncode)
-            # Print the output
-            #print("Output:", result.stdout)
-            # Print the errors, if there are any
-            #print("Error:", result.stderr)
-            # Check for errors
-            #if result.returncode != 0:
-            #    print("Command failed.")
-        return result
+        return run_command(command_parts, **kwargs)
+
+def expand_wildcards(path):
+    """
+    Expand the wildcards of a local path, as a shell would.
+    Remote paths (host:path) are left for the remote shell.
+    Return a list of paths, which is empty if nothing matched.
+    """
+    path = str(path)
+    if ':' in path or not any(c in path for c in '*?['):
+        return [path]
+    return sorted(glob.glob(path))
 
 def rsync_level(n: int):
     """
@@ -57,12 +189,16 @@ def rsync_level(n: int):
     return arguments
     
 def get_rsync_options(level=-1, files_only=False, with_filter=True,
-                      dry_run=False, **kwargs):
+                      dry_run=False, rsh=None, **kwargs):
 
     arguments = ['-avh']
     if with_filter:
         arguments.append('-F')
 
+    # Remote shell, e.g. ssh with a shared connection.
+    if rsh:
+        arguments.extend(['-e', rsh])
+
     if dry_run:
         arguments.append('-n')
 
@@ -74,5 +210,7 @@ def get_rsync_options(level=-1, files_only=False, with_filter=True,
 
 def get_rsync_command_parts(source, dest, **kwargs):
     options = get_rsync_options(**kwargs)
-    command_parts = ["rsync", source, dest] + options
+    # Without a shell, local wildcards are expanded here.
+    sources = expand_wildcards(source) or [str(source)]
+    command_parts = ["rsync"] + sources + [str(dest)] + options
     return command_parts